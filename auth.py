@@ -0,0 +1,139 @@
+"""Caching of Spotify access tokens between script invocations.
+
+Refreshing a user token is a round trip to the accounts service, so rather than
+doing it every time a script starts, the access token and its expiry are saved
+to a file next to the Tekore config file, and reused until they're about to
+expire (or until the API rejects them)."""
+
+import json
+import os.path
+import time
+
+import tekore
+
+
+def token_filename(tekore_cfg_file):
+    """Returns the name of the file the access token is cached in, for a given
+    Tekore config file, e.g. "tekore.token.json" for "tekore.cfg"."""
+    return os.path.splitext(tekore_cfg_file)[0] + ".token.json"
+
+
+class CachedToken:
+    """Wraps a `tekore.Token`. Refreshes it lazily when it is about to expire or
+    when `refresh()` is called, and saves it to `filename` when it changes.
+
+    Tekore only ever uses `str(token)` to build request headers, so this can be
+    passed anywhere Tekore expects a token."""
+
+    def __init__(self, token, credentials, filename):
+        self._token = token
+        self.credentials = credentials
+        self.filename = filename
+
+    def __str__(self):
+        return self.access_token
+
+    @property
+    def access_token(self):
+        if self._token.is_expiring:
+            self.refresh()
+        return self._token.access_token
+
+    @property
+    def refresh_token(self):
+        return self._token.refresh_token
+
+    @property
+    def scope(self):
+        return self._token.scope
+
+    @property
+    def expires_at(self):
+        return self._token.expires_at
+
+    def refresh(self):
+        self._token = self.credentials.refresh_user_token(self._token.refresh_token)
+        self.save()
+
+    def save(self):
+        data = {
+            'access_token': self._token.access_token,
+            'token_type': self._token.token_type,
+            'expires_at': self._token.expires_at,
+            'scope': str(self._token.scope),
+            'refresh_token': self._token.refresh_token,
+        }
+        fp = open(self.filename, 'w')
+        json.dump(data, fp, indent=2)
+        fp.close()
+
+    @classmethod
+    def from_file(cls, filename, credentials, refresh_token):
+        """Returns a `CachedToken` from the file, or None if there's no cached
+        token, or if it was issued for a different refresh token, or if it's
+        about to expire anyway."""
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            fp = open(filename)
+            data = json.load(fp)
+            fp.close()
+        except (OSError, ValueError):
+            return None
+
+        if data.get('refresh_token') != refresh_token:
+            return None
+
+        expires_in = data['expires_at'] - int(time.time())
+        token_info = {
+            'access_token': data['access_token'],
+            'token_type': data['token_type'],
+            'expires_in': expires_in,
+            'scope': data['scope'],
+            'refresh_token': data['refresh_token'],
+        }
+        token = tekore.Token(token_info, uses_pkce=False)
+        if token.is_expiring:
+            return None
+
+        return cls(token, credentials, filename)
+
+    @classmethod
+    def from_refresh_token(cls, filename, credentials, refresh_token):
+        token = credentials.refresh_user_token(refresh_token)
+        obj = cls(token, credentials, filename)
+        obj.save()
+        return obj
+
+
+class TokenRefreshingSender(tekore.ExtendingSender):
+    """Sender that refreshes the token and tries again once if the API responds
+    with 401 Unauthorized, e.g. because the cached token was revoked early."""
+
+    def __init__(self, token, sender=None):
+        super().__init__(sender)
+        self.token = token
+
+    def _is_token_rejected(self, request, response):
+        return response.status_code == 401 and 'Authorization' in (request.headers or {})
+
+    def _with_new_token(self, request):
+        self.token.refresh()
+        request.headers['Authorization'] = f"Bearer {self.token.access_token}"
+        return request
+
+    def send(self, request):
+        if self.is_async:
+            return self._async_send(request)
+
+        response = self.sender.send(request)
+        if self._is_token_rejected(request, response):
+            response = self.sender.send(self._with_new_token(request))
+        return response
+
+    async def _async_send(self, request):
+        response = await self.sender.send(request)
+        if self._is_token_rejected(request, response):
+            response = await self.sender.send(self._with_new_token(request))
+        return response
@@ -0,0 +1,140 @@
+"""Files tracks that aren't in any tempo playlist into tempo playlists in bulk,
+based on Spotify's reported tempo. Tracks whose tempo is clearly in one tempo
+playlist's range are filed automatically; the rest are left for you to sort
+interactively.
+
+A tempo is clear if, after doubling or halving it to be between 60 and 140, it
+is at least --margin bpm from the boundary between two tempo playlists, and the
+original tempo is at least --clip-margin bpm from where it would be doubled or
+halved (60 or 140), since tempos near there could easily be read either way.
+
+Runs a dry run (i.e. does not add anything) by default. Use --confirm-autofile
+to actually file the tracks."""
+
+import argparse
+import re
+
+import numpy as np
+
+from cached import CachedPlaylist
+from profiles import add_profile_argument, get_profile
+from sort import PlaylistSorter, SkipTrack, update_cache
+from utils import batches, parse_playlist_arg
+
+
+def plan_tempo_filing(tempos, available, margin=2, clip_margin=5):
+    """`tempos` is an array of Spotify-reported tempos, NaN where unknown, and
+    `available` is a list of the tempos (in bpm) that have tempo playlists.
+    Returns a tuple `(nearest, clear)` of arrays: the nearest tempo list (in bpm)
+    for each track, and whether that's clear enough to file automatically."""
+    tempos = np.asarray(tempos, dtype=float)
+    clipped = np.where(tempos < 60, tempos * 2, np.where(tempos > 140, tempos / 2, tempos))
+    nearest = np.round(clipped, -1)
+    boundary_distance = 5 - np.abs(clipped - nearest)
+    clip_distance = np.minimum(np.abs(tempos - 60), np.abs(tempos - 140))
+
+    with np.errstate(invalid='ignore'):  # NaN comparisons are False, which is what we want
+        is_available = np.isin(nearest, np.asarray(available, dtype=float))
+        clear = (boundary_distance >= margin) & (clip_distance >= clip_margin) & is_available
+    return nearest, clear
+
+
+def find_unfiled_track_ids(source_playlist, tempo_playlists):
+    in_tempo = set()
+    for playlist in tempo_playlists:
+        in_tempo.update(playlist.track_ids)
+    unfiled = dict.fromkeys(tid for tid in source_playlist.track_ids if tid not in in_tempo)
+    return list(unfiled)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('playlist', nargs='?',
+        help="playlist with tracks to file, specify by either name or ID (default WCS all)")
+    parser.add_argument('--margin', type=float, default=2,
+        help="minimum distance (bpm) from a tempo list boundary to file automatically (default 2)")
+    parser.add_argument('--clip-margin', type=float, default=5,
+        help="minimum distance (bpm) from 60 or 140 to file automatically (default 5)")
+    parser.add_argument('--confirm-autofile', action='store_true', default=False,
+        help="actually add the tracks to tempo playlists")
+    parser.add_argument("--no-interactive", action="store_false", default=True, dest="interactive",
+        help="don't prompt for tracks that can't be filed automatically")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    parser.add_argument("--playback-start", '-s', type=float, default=15,
+        help="start playback this far through the song (default 15)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    import tekore
+
+    scope = tekore.Scope(tekore.scope.user_modify_playback_state, tekore.scope.playlist_modify_public)
+    profile = get_profile(args.profile)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+
+    sorter = PlaylistSorter(sp, playback_start_position_ms=int(args.playback_start * 1000),
+                            cache_dir=profile.cache_dir, all_playlist_id=profile.all_playlist_id,
+                            all_playlist_name=profile.all_playlist_name)
+    if args.playlist:
+        playlist_id = parse_playlist_arg(args.playlist, cache_dir=profile.cache_dir)
+        source = CachedPlaylist.from_playlist_id(playlist_id, sp)
+    else:
+        source = sorter.all_playlist
+
+    track_ids = find_unfiled_track_ids(source, sorter.tempo_playlists)
+    print(f"{len(track_ids)} tracks in {source.name} aren't in any tempo playlist.")
+    if not track_ids:
+        exit(0)
+
+    with sp.chunked(True):
+        features = sp.tracks_audio_features(track_ids)
+    tempos = [f.tempo if f is not None else np.nan for f in features]
+    tempo_playlists_by_bpm = {}
+    for playlist in sorter.tempo_playlists:
+        match = re.fullmatch(r"WCS (\d+)bpm", playlist.name)
+        if match:
+            tempo_playlists_by_bpm[int(match.group(1))] = playlist
+    nearest, clear = plan_tempo_filing(tempos, list(tempo_playlists_by_bpm.keys()),
+                                       args.margin, args.clip_margin)
+
+    to_file = {}  # playlist: [track_id]
+    for track_id, bpm in zip(np.array(track_ids)[clear].tolist(), nearest[clear].tolist()):
+        playlist = tempo_playlists_by_bpm[int(bpm)]
+        to_file.setdefault(playlist, []).append(track_id)
+    ambiguous_ids = np.array(track_ids)[~clear].tolist()
+
+    print(f"{np.count_nonzero(clear)} can be filed automatically, {len(ambiguous_ids)} are ambiguous.")
+    for playlist, ids in to_file.items():
+        action = "\033[0;32m→ adding\033[0m" if args.confirm_autofile else "Would add"
+        print(f"{action} {len(ids)} tracks to {playlist.name}")
+        if not args.confirm_autofile:
+            continue
+        for batch in batches(ids):
+            sp.playlist_add(playlist.id, ["spotify:track:" + track_id for track_id in batch])
+        for track_id in ids:
+            playlist.add_track_id(track_id)
+
+    if not args.confirm_autofile:
+        print("Use --confirm-autofile to follow through with filing these tracks.")
+        exit(0)
+
+    update_cache(profile.path('tempo.json'), sorter.tempo_playlists)
+
+    if not args.interactive or not ambiguous_ids:
+        exit(0)
+
+    print()
+    with sp.chunked(True):
+        ambiguous_tracks = sp.tracks(ambiguous_ids)
+    sorter.prefetch_tracks_info(ambiguous_tracks)
+    for track in ambiguous_tracks:
+        sorter.show_track_info(track)
+        sorter.show_existing_playlists(track)
+        sorter.start_playback(track)
+        try:
+            sorter.add_to_tempo_playlist(track)
+        except SkipTrack:
+            print("\033[0;35m◁ Skipping this track\033[0m")
+        print()
@@ -0,0 +1,76 @@
+"""Measures how long scripts take to start up, by running each of them with
+--help (or some other command that doesn't need the network) several times and
+reporting the fastest and median wall times. Use this to check that a change
+hasn't made startup slower, e.g. by importing something heavy at module level.
+
+With --importtime, also shows the slowest imports for each command, from
+Python's -X importtime."""
+
+import argparse
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COMMANDS = [
+    ["track.py", "--help"],
+    ["playlist.py", "--help"],
+    ["sort.py", "--help"],
+    ["check_all.py", "--help"],
+    ["update.py", "--help"],
+    ["sync.py", "--help"],
+    ["dupes.py", "--help"],
+    ["stats.py", "--help"],
+    ["-c", "import sort; sort.PlaylistSorter(None)"],  # set up a sorter without using the API
+]
+
+
+def time_command(command, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=HERE, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def slowest_imports(command, n=8):
+    """Returns the `n` slowest top-level imports as (cumulative µs, module) pairs."""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=HERE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue  # header line
+        name = fields[2].rstrip()
+        if not name.startswith("  "):  # top-level imports only, nested ones are included in these
+            imports.append((cumulative, name.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", "-n", type=int, default=5,
+        help="number of times to run each command (default 5)")
+    parser.add_argument("--importtime", action="store_true", default=False,
+        help="also show the slowest imports for each command")
+    args = parser.parse_args()
+
+    width = max(len(" ".join(command)) for command in COMMANDS)
+    print(f"{'command':{width}s} │    min │ median")
+    for command in COMMANDS:
+        fastest, median = time_command(command, args.repeat)
+        print(f"{' '.join(command):{width}s} │ {fastest * 1000:4.0f}ms │ {median * 1000:4.0f}ms")
+        if args.importtime:
+            for cumulative, name in slowest_imports(command):
+                print(f"\033[0;90m{'':{width}s}   {cumulative / 1000:6.1f}ms {name}\033[0m")
@@ -1,21 +1,85 @@
-"""Classes for cached playlists."""
+"""Classes for cached playlists.
 
+Cache files are written atomically (to a temporary file that then replaces the
+old one) while holding a lock, so that several scripts can share them. Scripts
+that change playlists while other scripts might be doing the same, like two
+sort.py sessions at once, should save with `merge_and_save()`, which applies
+only this process's changes to what's currently in the file."""
+
+import collections
+import contextlib
+import functools
 import json
-from typing import List
+import os
+from typing import Callable, List, Optional, Tuple
 
 from categories import CATEGORIES
 
 
+@contextlib.contextmanager
+def locked_cache_file(filename):
+    """Holds an exclusive lock for writing `filename`, using a separate lock
+    file next to it, so that the cache file itself can be replaced."""
+    import fcntl
+
+    fp = open(filename + '.lock', 'w')
+    try:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fp, fcntl.LOCK_UN)
+        fp.close()
+
+
+def write_json_atomically(filename, data, **kwargs):
+    """Writes to a temporary file, then replaces `filename` with it, so that
+    readers never see a partly written file."""
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    fp = open(tmp_filename, 'w')
+    json.dump(data, fp, **kwargs)
+    fp.close()
+    os.replace(tmp_filename, filename)
+
+
+def iter_track_ids(playlist, spotify, track_info=None):
+    """Yields the IDs of all (non-local) tracks in `playlist`, a simple or full
+    tekore playlist, a page at a time as pages arrive, so that only one page of
+    items is held at once. If `track_info` (a `TrackInfoCache`) is provided,
+    also records the tracks' information in it."""
+    if hasattr(playlist.tracks, "items"):
+        items = spotify.all_items(playlist.tracks)
+    else:
+        items = spotify.all_items(spotify.playlist_items(playlist.id))
+    for item in items:
+        if item.track is None or item.track.id is None:
+            continue
+        if track_info is not None:
+            track_info.record_item(item)
+        yield item.track.id
+
+
+def fetch_track_ids(playlist, spotify, track_info=None):
+    """Returns a list of the IDs of all (non-local) tracks in `playlist`, as
+    for `iter_track_ids()`."""
+    return list(iter_track_ids(playlist, spotify, track_info))
+
+
 class CachedPlaylist:
 
     id: str
     name: str
+    snapshot_id: Optional[str]
     track_ids: List[str]
+    changes: List[Tuple[str, str]]  # ('add' or 'remove', track_id) since last saved
+    observers: List[Callable]       # called with ('add' or 'remove', track_id) when membership changes
 
-    def __init__(self, playlist_id, name):
+    def __init__(self, playlist_id, name, snapshot_id=None):
         self.id = playlist_id
         self.name = name
+        self.snapshot_id = snapshot_id
         self.track_ids = []
+        self.changes = []
+        self.observers = []
 
     def __len__(self):
         return len(self.track_ids)
@@ -29,18 +93,14 @@ class CachedPlaylist:
         return cls.from_tekore_playlist(playlist, spotify)
 
     @classmethod
-    def from_tekore_playlist(cls, playlist, spotify):
-        obj = cls(playlist.id, playlist.name)
-        if hasattr(playlist.tracks, "items"):
-            items = spotify.all_items(playlist.tracks)
-        else:
-            items = spotify.all_items(spotify.playlist_items(playlist.id))
-        obj.track_ids = [item.track.id for item in items if item.track.id is not None]
+    def from_tekore_playlist(cls, playlist, spotify, track_info=None):
+        obj = cls(playlist.id, playlist.name, playlist.snapshot_id)
+        obj.track_ids = fetch_track_ids(playlist, spotify, track_info)
         return obj
 
     @classmethod
     def from_cached_dict(cls, data):
-        obj = cls(data['id'], data['name'])
+        obj = cls(data['id'], data['name'], data.get('snapshot_id'))
         obj.track_ids = data['track_ids']
         return obj
 
@@ -51,12 +111,70 @@ class CachedPlaylist:
         return track_id in self.track_ids
 
     def add_track_id(self, track_id):
+        was_present = bool(self.observers) and track_id in self.track_ids
         self.track_ids.append(track_id)
+        self.changes.append(('add', track_id))
+        if not was_present:
+            self._notify('add', track_id)
+
+    def remove_track_id(self, track_id):
+        was_present = bool(self.observers) and track_id in self.track_ids
+        self.track_ids = [tid for tid in self.track_ids if tid != track_id]
+        self.changes.append(('remove', track_id))
+        if was_present:
+            self._notify('remove', track_id)
+
+    def set_track_ids(self, track_ids):
+        """Replaces the track IDs without recording them as changes, e.g. with
+        what's just been saved. Observers are told about the differences."""
+        previous = set(self.track_ids)
+        self.track_ids = track_ids
+        if self.observers:
+            current = set(track_ids)
+            for track_id in previous - current:
+                self._notify('remove', track_id)
+            for track_id in current - previous:
+                self._notify('add', track_id)
+
+    def _notify(self, action, track_id):
+        for observer in self.observers:
+            observer(action, track_id)
+
+    def apply_changes(self, changes):
+        """Applies changes recorded by another copy of this playlist. Tracks
+        that are already there aren't added again."""
+        for action, track_id in changes:
+            if action == 'add' and track_id not in self.track_ids:
+                self.add_track_id(track_id)
+            elif action == 'remove':
+                self.remove_track_id(track_id)
+
+    def update_from_tekore_playlist(self, playlist, spotify, track_info=None):
+        """Brings this cached playlist up to date with `playlist`, a (simple or
+        full) tekore playlist, by applying the differences in place. Returns a
+        tuple `(added, removed)` of the sets of track IDs added and removed."""
+        current = set(self.track_ids)
+        seen = set()
+        to_add = []
+        for track_id in iter_track_ids(playlist, spotify, track_info):
+            seen.add(track_id)
+            if track_id not in current:
+                to_add.append(track_id)
+        removed = current - seen
+        for track_id in removed:
+            self.remove_track_id(track_id)
+        for track_id in to_add:
+            self.add_track_id(track_id)
+        added = set(to_add)
+        self.name = playlist.name
+        self.snapshot_id = playlist.snapshot_id
+        return added, removed
 
     def serialize(self):
         return {
             'id': self.id,
             'name': self.name,
+            'snapshot_id': self.snapshot_id,
             'track_ids': self.track_ids,
         }
 
@@ -99,6 +217,36 @@ class CachedPlaylistGroup:
         group.add_from_file(fp)
         return group
 
+    def save_to_filename(self, filename):
+        """Overwrites the file with this group. Use this only if this group
+        should replace whatever's there, e.g. if it's just been fetched from
+        Spotify; otherwise use `merge_and_save()`."""
+        with locked_cache_file(filename):
+            write_json_atomically(filename, self.serialize(), indent=2)
+        for playlist in self.playlists:
+            playlist.changes = []
+
+    def merge_and_save(self, filename):
+        """Saves this group's changes to the file, keeping changes that other
+        processes have saved since it was loaded. While holding the lock, the
+        file is reloaded, each playlist's changes since it was last saved are
+        applied to the copy in the file, and the result is written back. This
+        group's playlists are then brought up to date with the file."""
+        with locked_cache_file(filename):
+            on_disk = CachedPlaylistGroup.from_filename(filename) if os.path.exists(filename) \
+                else CachedPlaylistGroup()
+            on_disk_by_id = {playlist.id: playlist for playlist in on_disk}
+            for playlist in self.playlists:
+                if playlist.id in on_disk_by_id:
+                    on_disk_by_id[playlist.id].apply_changes(playlist.changes)
+                else:
+                    on_disk.add_playlist(playlist)
+            write_json_atomically(filename, on_disk.serialize(), indent=2)
+
+        for playlist in self.playlists:
+            playlist.set_track_ids(list(on_disk_by_id.get(playlist.id, playlist).track_ids))
+            playlist.changes = []
+
     def playlists_containing_track(self, track_id):
         return [playlist for playlist in self.playlists if track_id in playlist.track_ids]
 
@@ -136,8 +284,84 @@ class CachedPlaylistGroup:
         return [obj.serialize() for obj in self.playlists]
 
 
-def all_cached_playlists():
+class LazyCachedPlaylistGroup(CachedPlaylistGroup):
+    """A `CachedPlaylistGroup` that doesn't load its playlists until they're
+    first needed. Each source is either a cache filename, or a function that
+    returns playlists (e.g. those of another group, so that both groups share
+    the same `CachedPlaylist` objects)."""
+
+    def __init__(self, *sources):
+        self._sources = sources
+        self._playlists = None
+
+    @property
+    def playlists(self):
+        if self._playlists is None:
+            self._playlists = []
+            for source in self._sources:
+                if isinstance(source, str):
+                    self.add_from_filename(source)
+                else:
+                    self.add_playlists(source())
+        return self._playlists
+
+    @playlists.setter
+    def playlists(self, playlists):
+        self._playlists = playlists
+
+
+class FilingIndex:
+    """Keeps count of how many tempo and genre playlists each track is in, and
+    the set of tracks that aren't properly filed, i.e. that aren't in the all
+    playlist, exactly one tempo playlist and at least one genre playlist. It's
+    built by going through the playlists once, then kept up to date by watching
+    them for changes, so checking a track or listing the tracks that aren't
+    properly filed doesn't need to look through any playlists."""
+
+    def __init__(self, tempo_playlists, genre_playlists, all_playlist):
+        self.tempo_counts = collections.Counter()  # track_id: number of tempo playlists it's in
+        self.genre_counts = collections.Counter()  # track_id: number of genre playlists it's in
+        self.all_counts = collections.Counter()    # track_id: 1 if it's in the all playlist
+        self.unsorted = set()
+
+        for playlist in tempo_playlists:
+            self._watch(playlist, self.tempo_counts)
+        for playlist in genre_playlists:
+            self._watch(playlist, self.genre_counts)
+        self._watch(all_playlist, self.all_counts)
+
+        for track_id in self.all_counts.keys() | self.tempo_counts.keys() | self.genre_counts.keys():
+            self._refresh(track_id)
+
+    def __len__(self):
+        """Returns the number of tracks in any of the playlists."""
+        return len(self.all_counts.keys() | self.tempo_counts.keys() | self.genre_counts.keys())
+
+    def _watch(self, playlist, counts):
+        counts.update(set(playlist.track_ids))
+        playlist.observers.append(functools.partial(self._changed, counts))
+
+    def _changed(self, counts, action, track_id):
+        counts[track_id] += 1 if action == 'add' else -1
+        if counts[track_id] <= 0:
+            del counts[track_id]
+        self._refresh(track_id)
+
+    def _refresh(self, track_id):
+        tracked = any(track_id in counts
+                      for counts in (self.all_counts, self.tempo_counts, self.genre_counts))
+        if tracked and not self.is_properly_filed(track_id):
+            self.unsorted.add(track_id)
+        else:
+            self.unsorted.discard(track_id)
+
+    def is_properly_filed(self, track_id):
+        in_all = self.all_counts[track_id] > 0
+        return in_all and self.tempo_counts[track_id] == 1 and self.genre_counts[track_id] >= 1
+
+
+def all_cached_playlists(cache_dir='.'):
     group = CachedPlaylistGroup()
     for filename in CATEGORIES.keys():
-        group.add_from_filename(filename)
+        group.add_from_filename(os.path.join(cache_dir, filename))
     return group
@@ -50,6 +50,19 @@ STATUS_PLAYLISTS = [
     "WCS released since 2020-10-16",
 ]
 
+# Status playlists that are defined by a date window. Each rule is a tuple
+# (field, start, end), meaning tracks whose `field` ('added' or 'released') is on
+# or after `start` and before `end`. Either can be None for no limit. These are
+# kept in sync by `sync.py status`.
+STATUS_RULES = {
+    "WCS added since 2019-07-01": ('added', "2019-07-01", None),
+    "WCS added since 2019-11-14": ('added', "2019-11-14", None),
+    "WCS added during lockdown": ('added', "2020-03-26", "2020-05-14"),
+    "WCS released during lockdown": ('released', "2020-03-26", "2020-05-14"),
+    "WCS added since 2020-10-16": ('added', "2020-10-16", None),
+    "WCS released since 2020-10-16": ('released', "2020-10-16", None),
+}
+
 SPECIAL_PLAYLISTS = [
     "WCS half-time/double-time",
     "WCS high-tempo low-energy?",
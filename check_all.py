@@ -6,30 +6,19 @@ playlists.
 """
 
 import argparse
-import itertools
-
-import tekore
+import os.path
 
+import daemon_client
+from profiles import add_profile_argument, get_profile
+from session import start_or_resume
 from sort import PlaylistSorter
 from update import update_cached_playlists
-from utils import format_artists, get_spotify_object
-
+from utils import format_artists, with_next
 
-parser = argparse.ArgumentParser(description=__doc__)
-parser.add_argument("--tekore-cfg", '-T', type=str, default='tekore.cfg',
-    help="file to use to store Tekore (Spotify) user token (default tekore.cfg)")
-parser.add_argument("--playback-start", '-s', type=float, default=15,
-    help="start playback this far through the song (default 15)")
-parser.add_argument("--list", '-l', action='store_true', default=False,
-    help="list offending tracks, don't rectify")
-parser.add_argument("--skip-update-cache", '-v', action='store_false', default=True, dest='update_cache',
-    help="skip updating the cache (use this if you ran update.py just now)")
-parser.add_argument("--browser", type=str, default="wslview",
-    help="browser to open searches in (default wslview)")
-args = parser.parse_args()
+SESSION_FILENAME = 'check_all.session.json'
 
 
-def print_quick_info(track):
+def print_quick_info(sorter, track):
     already_in = sorter.all_cached_playlists.playlists_containing_track(track.id)
     names = [playlist.name for playlist in already_in]
     names = [name[4:] if name.startswith("WCS ") else name for name in names]
@@ -37,39 +26,93 @@ def print_quick_info(track):
     print(f"- {track.name} \033[90m{format_artists(track.artists)} \033[0;34m{names}\033[0m")
 
 
-scope = tekore.Scope(tekore.scope.user_modify_playback_state, tekore.scope.playlist_modify_public)
-sp = get_spotify_object(args.tekore_cfg, scope=scope)
-
-if args.update_cache:
-    print("\033[1;36mUpdating the cache (skip this using the -v option)\033[0m")
-    update_cached_playlists(sp)
-
-sorter = PlaylistSorter(sp,
-    prompt_for_all=True,
-    playback_start_position_ms=args.playback_start * 1000,
-    browser=args.browser)
-
-# Collate all tracks in relevant list
-all_track_ids = set()
-all_track_ids.update(sorter.all_playlist.track_ids)
-for playlist in itertools.chain(sorter.tempo_playlists, sorter.genre_playlists):
-    all_track_ids.update(playlist.track_ids)
+def find_offending_tracks(sp, sorter):
+    """Returns a list of tracks that aren't properly sorted, after printing a
+    summary."""
+
+    filing_index = sorter.filing_index
+    offending_track_ids = list(filing_index.unsorted)
+
+    print(f"There are {len(filing_index)} tracks in total ({len(sorter.all_playlist)} in WCS all),")
+    print(f"of which {len(offending_track_ids)} tracks have some inconsistent filing.")
+
+    with sp.chunked(True):
+        return sp.tracks(offending_track_ids)
+
+
+def list_offending_tracks(sp, sorter):
+    for track in find_offending_tracks(sp, sorter):
+        print_quick_info(sorter, track)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    parser.add_argument("--playback-start", '-s', type=float, default=15,
+        help="start playback this far through the song (default 15)")
+    parser.add_argument("--list", '-l', action='store_true', default=False,
+        help="list offending tracks, don't rectify")
+    parser.add_argument("--skip-update-cache", '-v', action='store_false', default=True,
+        dest='update_cache',
+        help="skip updating the cache (use this if you ran update.py just now)")
+    parser.add_argument("--browser", type=str, default="wslview",
+        help="browser to open searches in (default wslview)")
+    parser.add_argument("--queue-next", action="store_true", default=False,
+        help="also add the next track to the playback queue when starting playback")
+    parser.add_argument("--resume", action="store_true", default=False,
+        help=f"resume the last session from where it stopped (saved in {SESSION_FILENAME})")
+    add_profile_argument(parser)
+    daemon_client.add_daemon_arguments(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    if args.list and args.use_daemon:
+        status = daemon_client.query(args.socket, 'check', profile.name, update_cache=args.update_cache)
+        if status is not None:
+            exit(status)
+
+    import tekore
+
+    scope = tekore.Scope(tekore.scope.user_modify_playback_state, tekore.scope.playlist_modify_public)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+
+    session, resumed = None, False
+    if not args.list:
+        session, resumed = start_or_resume(os.path.join(profile.cache_dir, SESSION_FILENAME),
+                                           {'script': 'check_all'}, args.resume)
+
+    if args.update_cache and not resumed:
+        print("\033[1;36mUpdating the cache (skip this using the -v option)\033[0m")
+        update_cached_playlists(sp, cache_dir=profile.cache_dir, all_playlist_id=profile.all_playlist_id)
+
+    sorter = PlaylistSorter(sp,
+        prompt_for_all=True,
+        playback_start_position_ms=args.playback_start * 1000,
+        browser=args.browser,
+        queue_next=args.queue_next,
+        cache_dir=profile.cache_dir,
+        all_playlist_id=profile.all_playlist_id,
+        all_playlist_name=profile.all_playlist_name)
 
-# Find the tracks that aren't properly sorted
-offending_track_ids = []
-for track_id in all_track_ids:
-    if not sorter.is_track_properly_sorted(track_id):
-        offending_track_ids.append(track_id)
-
-print(f"There are {len(all_track_ids)} tracks in total ({len(sorter.all_playlist)} in WCS all),")
-print(f"of which {len(offending_track_ids)} tracks have some inconsistent filing.")
-
-with sp.chunked(True):
-    offending_tracks = sp.tracks(offending_track_ids)
-
-for track in offending_tracks:
     if args.list:
-        print_quick_info(track)
+        list_offending_tracks(sp, sorter)
+        exit(0)
+
+    if resumed:
+        session.restore_prefetched(sorter)
     else:
-        sorter.sort_track(track)
+        tracks = find_offending_tracks(sp, sorter)
+        sorter.prefetch_tracks_info(tracks)
+        session.extend_queue(tracks)
+        session.store_prefetched(sorter)
+        session.save()
+
+    for (track, added_at), (next_track, _) in with_next(session.remaining(), (None, None)):
+        decision = sorter.sort_track(track, next_track=next_track)
+        session.store_prefetched(sorter)
+        session.record(track.id, decision)
         print()
+
+    session.finish()
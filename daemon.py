@@ -0,0 +1,187 @@
+"""Runs a local daemon that keeps the playlist cache, audio features, artists and
+a Spotify client warm, and serves requests over a Unix socket. While it's
+running, track.py, playlist.py and check_all.py --list hand their work to it
+instead of doing it themselves, which saves refreshing the token, parsing the
+cache and downloading the "all" playlist on every invocation.
+
+The daemon reloads the cache automatically when update.py (or anything else)
+rewrites the cache files. It serves one profile (see profiles.py), chosen with
+--profile when it starts, and scripts hand work to it only when they're run for
+the same profile. Stop it with Ctrl+C."""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import os.path
+import socketserver
+import traceback
+
+from categories import CATEGORIES
+from check_all import list_offending_tracks
+from daemon_client import DEFAULT_SOCKET, send_request
+from playlist import category_playlist_ids, get_currently_playing_playlist_id, show_playlists
+from profiles import add_profile_argument, get_profile
+from sort import PlaylistSorter
+from track import show_track
+from update import update_cached_playlists
+from utils import parse_playlist_arg
+
+
+class Daemon:
+    """Holds the warm state and runs commands against it. Commands print their
+    output, like the scripts they come from."""
+
+    def __init__(self, spotify, profile):
+        self.spotify = spotify
+        self.profile = profile
+        self.sorter = None
+        self.cache_mtimes = {}
+        self.load_cache()
+
+    def _current_cache_mtimes(self):
+        filenames = [self.profile.path(filename) for filename in CATEGORIES.keys()]
+        return {filename: os.path.getmtime(filename) for filename in filenames
+                if os.path.exists(filename)}
+
+    def load_cache(self):
+        """(Re)loads the playlist cache, keeping fetched audio features and
+        artists."""
+        old_sorter = self.sorter
+        self.cache_mtimes = self._current_cache_mtimes()
+        self.sorter = PlaylistSorter(self.spotify, prompt_for_all=True, playback_start_position_ms=None,
+                                     cache_dir=self.profile.cache_dir,
+                                     all_playlist_id=self.profile.all_playlist_id,
+                                     all_playlist_name=self.profile.all_playlist_name)
+        if old_sorter:
+            self.sorter.audio_features_cache = old_sorter.audio_features_cache
+            self.sorter.artists_cache = old_sorter.artists_cache
+
+    def reload_cache_if_changed(self):
+        if self._current_cache_mtimes() != self.cache_mtimes:
+            print("\033[0;90m(daemon: cache files changed, reloading)\033[0m")
+            self.load_cache()
+
+    def run(self, command, args):
+        method = getattr(self, "command_" + command, None)
+        if method is None:
+            print(f"\033[0;33mUnknown daemon command: {command}\033[0m")
+            exit(1)
+        if command != "reload":
+            self.reload_cache_if_changed()
+        method(**args)
+
+    # Commands
+
+    def command_ping(self):
+        print("pong")
+
+    def command_reload(self):
+        self.load_cache()
+        print("Reloaded the cache.")
+
+    def command_track(self, track=None, verbose=False, more_features=True, markets=None):
+        self.sorter.more_features = more_features
+        self.sorter.markets = markets
+        show_track(self.spotify, self.sorter, track, verbose)
+
+    def command_playlist(self, playlists=[], categories=[], combined=False, bpm_clip=True,
+                         release_date_precision='year'):
+        playlist_ids = [parse_playlist_arg(playlist, cache_dir=self.profile.cache_dir)
+                        for playlist in playlists]
+        for category in categories:
+            playlist_ids.extend(category_playlist_ids(category, self.profile.cache_dir))
+        if not playlist_ids:
+            playlist_ids = [get_currently_playing_playlist_id(self.spotify)]
+        show_playlists(self.spotify, playlist_ids, self.sorter.tempo_playlists,
+                       self.sorter.genre_playlists, bpm_clip, release_date_precision, combined)
+
+    def command_check(self, update_cache=True):
+        if update_cache:
+            print("\033[1;36mUpdating the cache (skip this using the -v option)\033[0m")
+            update_cached_playlists(self.spotify, cache_dir=self.profile.cache_dir,
+                                    all_playlist_id=self.profile.all_playlist_id)
+            self.load_cache()
+        list_offending_tracks(self.spotify, self.sorter)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Each request is one line of JSON, `{"command": ..., "args": {...},
+    "profile": ...}`. The response is one line of JSON, `{"output": ...,
+    "status": ..., "profile": ...}`, where `output` is everything the command
+    printed, `status` is its exit status and `profile` is the name of the
+    daemon's profile. If the request is for a different profile, the command
+    isn't run, and `output` and `status` are empty.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        profile = self.server.daemon.profile.name
+        output = io.StringIO()
+        status = 0
+        with contextlib.redirect_stdout(output):
+            try:
+                request = json.loads(line)
+                if request.get('profile') not in (None, profile):
+                    self.respond({'output': "", 'status': None, 'profile': profile})
+                    return
+                self.server.daemon.run(request['command'], request.get('args', {}))
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc(file=output)
+                status = 1
+
+        self.respond({'output': output.getvalue(), 'status': status, 'profile': profile})
+
+    def respond(self, response):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Handles one request at a time, since commands print to (redirected)
+    stdout and share the sorter's state."""
+
+    def __init__(self, socket_path, daemon):
+        self.daemon = daemon
+        super().__init__(socket_path, RequestHandler)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET,
+        help=f"Unix socket to listen on (default {DEFAULT_SOCKET})")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    import tekore
+
+    scope = tekore.Scope(tekore.scope.user_read_currently_playing, tekore.scope.user_read_playback_state,
+                         tekore.scope.playlist_read_private)
+    profile = get_profile(args.profile)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+
+    if os.path.exists(args.socket):
+        if send_request(args.socket, 'ping') is not None:
+            print(f"\033[0;33mA daemon is already listening on {args.socket}\033[0m")
+            exit(1)
+        os.remove(args.socket)  # left over from a daemon that didn't exit cleanly
+
+    daemon = Daemon(sp, profile)
+    server = DaemonServer(args.socket, daemon)
+    print(f"\033[1;32mListening on {args.socket}\033[0m (Ctrl+C to stop)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Okay, bye!")
+    finally:
+        server.server_close()
+        os.remove(args.socket)
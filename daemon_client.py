@@ -0,0 +1,52 @@
+"""Client side of the daemon in daemon.py. This deliberately imports only the
+standard library, so that scripts can hand requests to the daemon without
+paying for importing Tekore."""
+
+import json
+import socket
+
+DEFAULT_SOCKET = 'dynamite.sock'
+
+
+def add_daemon_arguments(parser):
+    """Adds the options common to all scripts that can use the daemon."""
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET,
+        help=f"Unix socket of the daemon (see daemon.py), used if it's running "
+             f"(default {DEFAULT_SOCKET})")
+    parser.add_argument("--no-daemon", action="store_false", default=True, dest="use_daemon",
+        help="don't use the daemon, even if it's running")
+
+
+def send_request(socket_path, command, profile=None, **kwargs):
+    """Sends a request to the daemon, and returns its response as a dict, or
+    None if the daemon isn't running. If `profile` is given, the daemon runs
+    the command only if it's serving the profile with that name; either way,
+    the response's 'profile' is the name of the profile it's serving."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    with sock, sock.makefile('rwb') as fp:
+        request = {'command': command, 'args': kwargs, 'profile': profile}
+        fp.write(json.dumps(request).encode() + b"\n")
+        fp.flush()
+        response = fp.readline()
+
+    if not response:
+        return None
+    return json.loads(response)
+
+
+def query(socket_path, command, profile, **kwargs):
+    """Asks the daemon to run `command` for the profile called `profile` and
+    prints its output. Returns the exit status, or None if the daemon isn't
+    running or is serving a different profile (in which case the caller should
+    do the work itself)."""
+    response = send_request(socket_path, command, profile, **kwargs)
+    if response is None or response.get('profile') != profile:
+        return None
+    print(response['output'], end="")
+    return response['status']
@@ -0,0 +1,201 @@
+"""Finds tracks that are the same recording under different track IDs (e.g. the
+single and the album version, or a remaster), and reports those that have been
+filed in different playlists.
+
+Tracks are the same recording if they have the same ISRC, or the same title and
+first artist after normalization (case, accents, punctuation, and suffixes like
+"- Remastered 2011" or "(Radio Edit)" are ignored, but not "(Live Version)" or
+"(Acoustic)", which are different recordings). Run update.py first, since
+this uses the track information it caches.
+
+With --merge, adds each track in such a cluster to every playlist any of them is
+in, except that clusters in different tempo playlists, or different decade pop
+playlists, are reported rather than merged into several of them. This is a dry run unless --confirm-merge
+is also given."""
+
+import argparse
+import re
+import unicodedata
+
+from cached import CachedPlaylistGroup
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+from utils import batches, is_decade_pop_playlist_name
+
+# Qualifiers that don't make it a different recording. "Live", "acoustic" and
+# other versions are different recordings, so only these are ignored.
+RELEASE_QUALIFIER = (r"(\d{4}\s+)?(digital(ly)?\s+)?remaster(ed)?(\s+\d{4})?(\s+version)?"
+                     r"|(single|radio|album)\s+(edit|version)|mono|stereo|(feat|ft)\.?\s.*")
+BRACKETED_VERSION_RE = re.compile(r"\s*[\(\[]\s*(" + RELEASE_QUALIFIER + r")\s*[\)\]]", re.IGNORECASE)
+DASHED_VERSION_RE = re.compile(r"\s+-\s+(" + RELEASE_QUALIFIER + r")\s*$", re.IGNORECASE)
+
+
+def normalize(text):
+    """Lowercases, strips accents and removes everything but letters and digits."""
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[\W_]+", "", text.lower())
+
+
+def normalize_title(title):
+    title = BRACKETED_VERSION_RE.sub("", title)
+    title = DASHED_VERSION_RE.sub("", title)
+    return normalize(title)
+
+
+def find_clusters(track_info):
+    """Returns a list of clusters (lists of track IDs) of at least two tracks
+    that are probably the same recording. Each track is looked up in two hash
+    indexes, by ISRC and by normalized title and artist, so this takes linear
+    time. Clusters are joined transitively, with a union-find."""
+    parent = {}
+
+    def find(track_id):
+        root = track_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[track_id] != root:  # path compression
+            parent[track_id], track_id = root, parent[track_id]
+        return root
+
+    first_by_key = {}
+    for track_id, info in track_info.tracks.items():
+        parent[track_id] = track_id
+        keys = []
+        if info.get('isrc'):
+            keys.append(('isrc', info['isrc'].upper()))
+        if info['artists'] and normalize_title(info['name']):
+            keys.append(('title', normalize_title(info['name']), normalize(info['artists'][0][1])))
+        for key in keys:
+            other = first_by_key.setdefault(key, track_id)
+            if other != track_id:
+                parent[find(track_id)] = find(other)
+
+    clusters = {}
+    for track_id in parent:
+        clusters.setdefault(find(track_id), []).append(track_id)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+def divergent_memberships(clusters, playlists):
+    """Returns a list of `(cluster, memberships)` tuples for the clusters whose
+    tracks aren't all in the same playlists, where `memberships` maps each track
+    ID in the cluster to the set of playlists (from `playlists`) it's in."""
+    playlists_by_track_id = {}
+    for playlist in playlists:
+        for track_id in playlist.track_ids:
+            playlists_by_track_id.setdefault(track_id, set()).add(playlist)
+
+    divergent = []
+    for cluster in clusters:
+        memberships = {track_id: playlists_by_track_id.get(track_id, set()) for track_id in cluster}
+        if len({frozenset(m) for m in memberships.values()}) > 1:
+            divergent.append((cluster, memberships))
+    return divergent
+
+
+def plan_merge(divergent, exclusive_sets=()):
+    """Returns a tuple `(to_add, conflicts)`. `to_add` is a dict mapping each
+    playlist to a list of the track IDs that need to be added to it, so that
+    every track in each cluster is in the union of the cluster's playlists.
+
+    `exclusive_sets` are collections of playlists a track should be in only one
+    of, like the tempo playlists, or the decade pop playlists (since copies can
+    be released in different decades). Playlists in each of these are merged
+    only if the cluster is in just one of them. `conflicts` is a list of
+    `(cluster, memberships)` tuples for clusters that are in more than one;
+    their other playlists are still merged."""
+    exclusive_sets = [set(playlists) for playlists in exclusive_sets]
+    to_add = {}
+    conflicts = []
+    for cluster, memberships in divergent:
+        union = set().union(*memberships.values())
+        conflicting = [playlists for playlists in exclusive_sets if len(union & playlists) > 1]
+        if conflicting:
+            conflicts.append((cluster, memberships))
+        for playlists in conflicting:
+            union -= playlists
+        for track_id in cluster:
+            for playlist in union - memberships[track_id]:
+                to_add.setdefault(playlist, []).append(track_id)
+    return to_add, conflicts
+
+
+def short_name(name):
+    return name[4:] if name.startswith("WCS ") else name
+
+
+def print_cluster(cluster, memberships, track_info):
+    for track_id in cluster:
+        info = track_info.get(track_id)
+        artists = ", ".join(name for artist_id, name in info['artists'])
+        names = ", ".join(sorted(short_name(p.name) for p in memberships[track_id])) or "(none)"
+        print(f"   [{track_id}] \"{info['name']}\" ({artists}) {info['release_date'] or ''}"
+              f" \033[0;36m{names}\033[0m")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--category", '-c', nargs='+', default=['tempo', 'genre'],
+        choices=['tempo', 'genre', 'special'],
+        help="categories of playlists to compare (default tempo genre)")
+    parser.add_argument("--merge", action='store_true', default=False,
+        help="add each track in a cluster to all playlists that any of them is in")
+    parser.add_argument("--confirm-merge", action='store_true', default=False,
+        help="actually change the playlists when merging")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    track_info = TrackInfoCache.from_filename(profile.path(TRACKS_FILENAME))
+    if len(track_info) == 0:
+        print("\033[0;33mNo track information cached yet, run update.py first\033[0m")
+        exit(1)
+
+    groups = {category: CachedPlaylistGroup.from_filename(profile.path(category + '.json'))
+              for category in args.category}
+    playlists = [playlist for group in groups.values() for playlist in group]
+
+    clusters = find_clusters(track_info)
+    divergent = divergent_memberships(clusters, playlists)
+    print(f"{len(clusters)} clusters of duplicate tracks, "
+          f"{len(divergent)} of them in different playlists.")
+    for cluster, memberships in divergent:
+        print()
+        print_cluster(cluster, memberships, track_info)
+
+    if not args.merge or not divergent:
+        exit(0)
+
+    print()
+    decade_pop_playlists = [playlist for playlist in groups.get('genre', [])
+                            if is_decade_pop_playlist_name(playlist.name)]
+    to_add, conflicts = plan_merge(divergent, [groups.get('tempo', []), decade_pop_playlists])
+    for cluster, memberships in conflicts:
+        print("\033[0;33mIn different tempo or decade pop playlists, so not merging those for:\033[0m")
+        print_cluster(cluster, memberships, track_info)
+    for playlist, track_ids in to_add.items():
+        action = "\033[0;32m→ adding\033[0m" if args.confirm_merge else "Would add"
+        print(f"{action} {len(track_ids)} tracks to {playlist.name}")
+
+    if not args.confirm_merge:
+        print("Use --confirm-merge to follow through with these changes.")
+        exit(0)
+
+    import tekore
+
+    scope = tekore.Scope(tekore.scope.playlist_read_private, tekore.scope.playlist_modify_public)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+    for playlist, track_ids in to_add.items():
+        for batch in batches(track_ids):
+            playlist.snapshot_id = sp.playlist_add(playlist.id,
+                    ["spotify:track:" + track_id for track_id in batch])
+        for track_id in track_ids:
+            playlist.add_track_id(track_id)
+
+    for category, group in groups.items():
+        group.merge_and_save(profile.path(category + '.json'))
@@ -0,0 +1,96 @@
+"""Cache of audio features for tracks in the library. update.py fetches features
+for tracks that don't have them yet, so after the first run this costs a
+request only for every 100 new tracks.
+
+Features are stored as a row of numbers per track, in the order of
+`FEATURE_NAMES`, so that they can be loaded straight into a NumPy matrix."""
+
+import json
+import os.path
+from typing import Dict, List
+
+DEFAULT_FILENAME = 'features.json'
+
+FEATURE_NAMES = [
+    'acousticness',
+    'danceability',
+    'energy',
+    'instrumentalness',
+    'liveness',
+    'loudness',
+    'speechiness',
+    'valence',
+    'tempo',
+    'duration_ms',
+    'key',
+    'mode',
+    'time_signature',
+]
+
+
+class AudioFeaturesCache:
+
+    features: Dict[str, List[float]]
+
+    def __init__(self):
+        self.features = {}
+
+    def __len__(self):
+        return len(self.features)
+
+    def __contains__(self, track_id):
+        return track_id in self.features
+
+    def add(self, features):
+        """Adds a tekore `AudioFeatures` object."""
+        self.features[features.id] = [float(getattr(features, name)) for name in FEATURE_NAMES]
+
+    def get(self, track_id, name):
+        row = self.features.get(track_id)
+        if row is None:
+            return None
+        return row[FEATURE_NAMES.index(name)]
+
+    def fetch_missing(self, spotify, track_ids):
+        """Fetches and adds features for any of `track_ids` that aren't already in
+        the cache. Returns the number of tracks fetched."""
+        missing = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in self.features]
+        if not missing:
+            return 0
+        with spotify.chunked(True):
+            fetched = spotify.tracks_audio_features(missing)
+        for features in fetched:
+            if features is not None:
+                self.add(features)
+        return len(missing)
+
+    def matrix(self, track_ids, names=FEATURE_NAMES):
+        """Returns a tuple `(found_ids, matrix)`, where `found_ids` is the list of
+        those `track_ids` that are in the cache, and `matrix` has a row for each
+        of them and a column for each of the features in `names`."""
+        import numpy as np
+
+        found_ids = [track_id for track_id in track_ids if track_id in self.features]
+        columns = [FEATURE_NAMES.index(name) for name in names]
+        matrix = np.array([self.features[track_id] for track_id in found_ids], dtype=float)
+        matrix = matrix.reshape(len(found_ids), len(FEATURE_NAMES))[:, columns]
+        return found_ids, matrix
+
+    def save_to_filename(self, filename=DEFAULT_FILENAME):
+        fp = open(filename, 'w')
+        json.dump({'names': FEATURE_NAMES, 'features': self.features}, fp)
+        fp.close()
+
+    @classmethod
+    def from_filename(cls, filename=DEFAULT_FILENAME):
+        """Returns the cache in `filename`, or an empty cache if there isn't
+        one yet (or if it was saved with different features)."""
+        obj = cls()
+        if not os.path.exists(filename):
+            return obj
+        fp = open(filename)
+        data = json.load(fp)
+        fp.close()
+        if data['names'] == FEATURE_NAMES:
+            obj.features = data['features']
+        return obj
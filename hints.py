@@ -0,0 +1,162 @@
+"""Learns which of my genre playlists go with which Spotify artist genres, so that
+sorting can show genre playlist guesses. Running this script rebuilds the model
+from scratch from the whole cache; after that, the sorter updates it as it files
+tracks.
+
+Run update.py first, since this uses the track information it caches."""
+
+import argparse
+import json
+import os.path
+from typing import Dict, List
+
+from cached import CachedPlaylistGroup
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+
+ARTISTS_FILENAME = 'artists.json'
+HINTS_FILENAME = 'genre_hints.json'
+
+
+class ArtistGenresCache:
+    """Spotify's genres for each artist."""
+
+    genres: Dict[str, List[str]]
+
+    def __init__(self):
+        self.genres = {}
+
+    def __len__(self):
+        return len(self.genres)
+
+    def add(self, artist):
+        """Adds a tekore `FullArtist` object."""
+        self.genres[artist.id] = list(artist.genres)
+
+    def tags_for_artists(self, artist_ids):
+        return sorted({tag for artist_id in artist_ids for tag in self.genres.get(artist_id, [])})
+
+    def fetch_missing(self, spotify, artist_ids):
+        missing = [aid for aid in dict.fromkeys(artist_ids) if aid not in self.genres]
+        if not missing:
+            return 0
+        with spotify.chunked(True):
+            artists = spotify.artists(missing)
+        for artist in artists:
+            self.add(artist)
+        return len(missing)
+
+    def save_to_filename(self, filename=ARTISTS_FILENAME):
+        fp = open(filename, 'w')
+        json.dump(self.genres, fp)
+        fp.close()
+
+    @classmethod
+    def from_filename(cls, filename=ARTISTS_FILENAME):
+        obj = cls()
+        if os.path.exists(filename):
+            fp = open(filename)
+            obj.genres = json.load(fp)
+            fp.close()
+        return obj
+
+
+class GenreHintModel:
+    """Sparse co-occurrence counts between Spotify artist genres ("tags") and
+    genre playlists. `counts[tag][playlist_name]` is the number of filed tracks
+    with that tag in that playlist, and `totals[tag]` is the number of filed
+    tracks with that tag. A playlist's score for a track is the average, over
+    the track's tags, of the fraction of tracks with that tag that are in the
+    playlist, so ranking takes time proportional to the number of tags."""
+
+    counts: Dict[str, Dict[str, int]]
+    totals: Dict[str, int]
+
+    def __init__(self):
+        self.counts = {}
+        self.totals = {}
+
+    def __len__(self):
+        return len(self.totals)
+
+    def observe(self, tags, playlist_name, new_track=True):
+        """Records that a track with these tags was filed in this playlist.
+        `new_track` should be False if this track has already been counted (in
+        another playlist)."""
+        for tag in tags:
+            if new_track:
+                self.totals[tag] = self.totals.get(tag, 0) + 1
+            playlist_counts = self.counts.setdefault(tag, {})
+            playlist_counts[playlist_name] = playlist_counts.get(playlist_name, 0) + 1
+
+    def rank(self, tags, n=3):
+        """Returns up to `n` (playlist_name, score) pairs, best first."""
+        scores = {}
+        known_tags = [tag for tag in tags if self.totals.get(tag)]
+        for tag in known_tags:
+            total = self.totals[tag]
+            for playlist_name, count in self.counts.get(tag, {}).items():
+                scores[playlist_name] = scores.get(playlist_name, 0) + count / total / len(known_tags)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
+
+    @classmethod
+    def from_cache(cls, genre_playlists, track_info, artist_genres):
+        model = cls()
+        counted = set()
+        for playlist in genre_playlists:
+            for track_id in playlist.track_ids:
+                info = track_info.get(track_id)
+                if info is None:
+                    continue
+                tags = artist_genres.tags_for_artists(artist_id for artist_id, name in info['artists'])
+                model.observe(tags, playlist.name, new_track=track_id not in counted)
+                counted.add(track_id)
+        return model
+
+    def save_to_filename(self, filename=HINTS_FILENAME):
+        fp = open(filename, 'w')
+        json.dump({'counts': self.counts, 'totals': self.totals}, fp)
+        fp.close()
+
+    @classmethod
+    def from_filename(cls, filename=HINTS_FILENAME):
+        """Returns the model in `filename`, or an empty model if there isn't one."""
+        obj = cls()
+        if os.path.exists(filename):
+            fp = open(filename)
+            data = json.load(fp)
+            fp.close()
+            obj.counts = data['counts']
+            obj.totals = data['totals']
+        return obj
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    import tekore
+
+    profile = get_profile(args.profile)
+    genre_playlists = CachedPlaylistGroup.from_filename(profile.path('genre.json'))
+    track_info = TrackInfoCache.from_filename(profile.path(TRACKS_FILENAME))
+    if len(track_info) == 0:
+        print("\033[0;33mNo track information cached yet, run update.py first\033[0m")
+        exit(1)
+
+    artist_genres = ArtistGenresCache.from_filename(profile.path(ARTISTS_FILENAME))
+    artist_ids = [artist_id for playlist in genre_playlists for track_id in playlist.track_ids
+                  for artist_id, name in (track_info.get(track_id) or {}).get('artists', [])]
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=tekore.Scope())
+    nfetched = artist_genres.fetch_missing(sp, artist_ids)
+    if nfetched:
+        print(f"Fetched genres for {nfetched} artists.")
+        artist_genres.save_to_filename(profile.path(ARTISTS_FILENAME))
+
+    model = GenreHintModel.from_cache(genre_playlists, track_info, artist_genres)
+    model.save_to_filename(profile.path(HINTS_FILENAME))
+    print(f"Learned genre hints from {len(model)} artist genres.")
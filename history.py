@@ -0,0 +1,248 @@
+"""History of which tracks were in which cached playlists, and when. update.py
+records to it whenever it refreshes a playlist whose snapshot ID has changed.
+
+The history is an append-only file with one JSON record per line. Each record
+is for one playlist at one time, and is either a keyframe (all the tracks in it)
+or a delta (the tracks added and removed since the previous record). A playlist
+gets a keyframe the first time it's recorded and then after every
+KEYFRAME_INTERVAL deltas, so finding what was in it at some time means applying
+at most that many deltas to the keyframe before it.
+
+Use this script to see what was in a playlist at some time:
+    history.py --playlist "WCS 120bpm" --at 2024-05-01
+or a track's filing history:
+    history.py --track spotify:track:...
+Times are in UTC; a date on its own means the end of that day."""
+
+import argparse
+import bisect
+import json
+import os.path
+import time
+from typing import Dict, List
+
+from cached import locked_cache_file
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+from utils import parse_potential_uri, WrongUriType
+
+DEFAULT_FILENAME = 'history.jsonl'
+KEYFRAME_INTERVAL = 20  # deltas between keyframes for each playlist
+
+
+class PlaylistHistory:
+
+    filename: str
+    records: Dict[str, List[dict]]  # playlist_id: records for that playlist, oldest first
+
+    def __init__(self, filename=DEFAULT_FILENAME):
+        self.filename = filename
+        self.records = {}
+        self.pending = []  # playlists' states not yet written to the file
+
+    def _add(self, record):
+        self.records.setdefault(record['playlist'], []).append(record)
+
+    def deltas_since_keyframe(self, playlist_id):
+        """Returns the number of deltas recorded since the last keyframe for the
+        playlist, or None if it doesn't have a keyframe yet."""
+        for i, record in enumerate(reversed(self.records.get(playlist_id, []))):
+            if 'track_ids' in record:
+                return i
+        return None
+
+    def record(self, playlist, timestamp=None):
+        """Records the current tracks of `playlist` (a `CachedPlaylist`, already
+        updated). Call `save()` to work out and write the new records."""
+        self.pending.append({
+            'time': timestamp or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            'playlist': playlist.id,
+            'name': playlist.name,
+            'snapshot_id': playlist.snapshot_id,
+            'track_ids': list(dict.fromkeys(playlist.track_ids)),
+        })
+
+    def _make_record(self, state):
+        """Returns the record for `state` (an entry of `pending`): a keyframe, or
+        a delta against what the history says was in the playlist at its last
+        record. Returns None if the snapshot ID hasn't changed since then."""
+        records = self.records.get(state['playlist'])
+        if records and records[-1]['snapshot_id'] == state['snapshot_id']:
+            return None
+
+        record = dict(state)
+        if records:
+            # Records are replayed in time order, so this mustn't go before the
+            # last one, which another process might have written meanwhile
+            record['time'] = max(record['time'], records[-1]['time'])
+        ndeltas = self.deltas_since_keyframe(state['playlist'])
+        if ndeltas is not None and ndeltas < KEYFRAME_INTERVAL:
+            previous = self.membership(state['playlist'], records[-1]['time'])
+            current = set(record.pop('track_ids'))
+            record['added'] = sorted(current - previous)
+            record['removed'] = sorted(previous - current)
+        return record
+
+    def save(self):
+        """Appends new records to the file. While holding the lock, the file is
+        reloaded and deltas are worked out against it, so that records other
+        processes (e.g. update.py --watch) have appended meanwhile are the base
+        for them, not the history as it was when this one was loaded."""
+        if not self.pending:
+            return
+        with locked_cache_file(self.filename):
+            self._load()
+            fp = open(self.filename, 'a')
+            for state in self.pending:
+                record = self._make_record(state)
+                if record is None:
+                    continue
+                self._add(record)
+                fp.write(json.dumps(record) + "\n")
+            fp.close()
+        self.pending = []
+
+    def membership(self, playlist_id, when):
+        """Returns the set of track IDs in the playlist at time `when` (a string
+        like "2024-05-01T12:00:00Z"), or None if it wasn't being recorded yet."""
+        records = self.records.get(playlist_id, [])
+        end = bisect.bisect_right([record['time'] for record in records], when)
+        start = end - 1
+        while start >= 0 and 'track_ids' not in records[start]:
+            start -= 1
+        if start < 0:
+            return None
+
+        track_ids = set(records[start]['track_ids'])
+        for record in records[start + 1:end]:
+            track_ids.difference_update(record['removed'])
+            track_ids.update(record['added'])
+        return track_ids
+
+    def track_history(self, track_id):
+        """Returns a list of `(time, playlist_name, action)` tuples, in time
+        order, where `action` is 'added' or 'removed'. A track that was already
+        in a playlist when it started being recorded counts as added then."""
+        events = []
+        for records in self.records.values():
+            present = False
+            for record in records:
+                if 'track_ids' in record:
+                    now_present = track_id in record['track_ids']
+                else:
+                    now_present = track_id in record['added'] or \
+                        (present and track_id not in record['removed'])
+                if now_present != present:
+                    action = 'added' if now_present else 'removed'
+                    events.append((record['time'], record['name'], action))
+                present = now_present
+        return sorted(events)
+
+    def playlist_id_by_name(self, name):
+        """Returns the ID of the playlist most recently recorded with this name
+        (or this name with "WCS " in front), or None."""
+        latest = {records[-1]['name'].lower(): playlist_id
+                  for playlist_id, records in self.records.items()}
+        return latest.get(name.lower()) or latest.get("wcs " + name.lower())
+
+    def _load(self):
+        """(Re)loads the records from the file."""
+        self.records = {}
+        if not os.path.exists(self.filename):
+            return
+        fp = open(self.filename)
+        for line in fp:
+            if line.strip():
+                self._add(json.loads(line))
+        fp.close()
+        for records in self.records.values():
+            # in case two processes appended out of order
+            records.sort(key=lambda record: record['time'])
+
+    @classmethod
+    def from_filename(cls, filename=DEFAULT_FILENAME):
+        """Returns the history in `filename`, or an empty history if there
+        isn't one yet."""
+        obj = cls(filename)
+        obj._load()
+        return obj
+
+
+def format_track(track_id, track_info):
+    info = track_info.get(track_id)
+    if not info:
+        return f"[{track_id}]"
+    artists = ", ".join(name for artist_id, name in info['artists'])
+    return f"[{track_id}] \"{info['name']}\" ({artists})"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--playlist", "-p", type=str,
+        help="show what was in this playlist (name or ID) at the time given by --at")
+    query.add_argument("--track", "-t", type=str,
+        help="show when this track (ID, URI or part of its name) was added to and removed from "
+             "playlists")
+    parser.add_argument("--at", type=str, default=None,
+        help="with --playlist, date or time to show (default now)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    history = PlaylistHistory.from_filename(profile.path(DEFAULT_FILENAME))
+    if not history.records:
+        print("\033[0;33mNo history recorded yet, run update.py first\033[0m")
+        exit(1)
+    track_info = TrackInfoCache.from_filename(profile.path(TRACKS_FILENAME))
+
+    if args.playlist:
+        try:
+            playlist_id = parse_potential_uri(args.playlist, uritype="playlist")
+        except WrongUriType as e:
+            print("\033[0;33m" + str(e) + "\033[0m")
+            exit(1)
+        playlist_id = playlist_id or history.playlist_id_by_name(args.playlist)
+        if playlist_id not in history.records:
+            print(f"\033[0;33mNo history for playlist {args.playlist}\033[0m")
+            exit(1)
+
+        when = args.at or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        if len(when) == 10:
+            when += "T23:59:59Z"
+        track_ids = history.membership(playlist_id, when)
+        name = history.records[playlist_id][-1]['name']
+        if track_ids is None:
+            print(f"\033[0;33m{name} wasn't being recorded yet at {when} "
+                  f"(history starts {history.records[playlist_id][0]['time']})\033[0m")
+            exit(1)
+        print(f"\033[1;36m{name}\033[0m at {when}: {len(track_ids)} tracks")
+        for track_id in sorted(track_ids, key=lambda tid: (track_info.get(tid) or {}).get('name', tid)):
+            print("   " + format_track(track_id, track_info))
+
+    else:
+        try:
+            track_id = parse_potential_uri(args.track, uritype="track")
+        except WrongUriType as e:
+            print("\033[0;33m" + str(e) + "\033[0m")
+            exit(1)
+        if track_id:
+            track_ids = [track_id]
+        else:
+            track_ids = [tid for tid, info in track_info.tracks.items()
+                         if args.track.lower() in info['name'].lower()]
+            if not track_ids:
+                print(f"\033[0;33mNo cached track matches \"{args.track}\"\033[0m")
+                exit(1)
+
+        for i, track_id in enumerate(track_ids):
+            if i > 0:
+                print()
+            print("\033[1;36m" + format_track(track_id, track_info) + "\033[0m")
+            events = history.track_history(track_id)
+            if not events:
+                print("   \033[0;90mnever in a recorded playlist\033[0m")
+            for timestamp, name, action in events:
+                sign = "\033[0;32m+" if action == 'added' else "\033[0;31m-"
+                print(f"   {timestamp} {sign} {name}\033[0m")
@@ -0,0 +1,121 @@
+"""Runs update.py or check_all.py --list for several profiles (see profiles.py)
+at once, in one process. Each profile gets its own thread, but they all share
+the pooled HTTP client and the rate limiter (see senders.py), so together
+they don't send requests any faster than one script would.
+
+What each profile prints is collected and printed in one piece when it's done,
+so that profiles' output isn't interleaved. Tokens are checked (and, if need
+be, prompted for) one profile at a time before anything starts."""
+
+import argparse
+import concurrent.futures
+import io
+import sys
+import threading
+
+from profiles import load_profiles
+
+
+class ThreadOutput(io.TextIOBase):
+    """Stands in for `sys.stdout`, sending what each worker thread prints to
+    that thread's own buffer, and everything else to the real stdout."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, 'buffer', None) or self.stdout
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def capture(self, function, *args, **kwargs):
+        """Calls `function` and returns everything it printed. Exceptions, and
+        exits (the scripts' functions call `exit()` on some errors), are printed
+        as part of the output, not raised."""
+        self.local.buffer = io.StringIO()
+        try:
+            function(*args, **kwargs)
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                print(f"\033[1;31m× Exited with status {e.code}\033[0m")
+        except Exception as e:
+            print(f"\033[1;31m× Failed: {e}\033[0m")
+        finally:
+            output = self.local.buffer.getvalue()
+            self.local.buffer = None
+        return output
+
+
+def update_profile(profile, spotify, create_missing=False):
+    from update import update_cached_playlists
+    update_cached_playlists(spotify, create_missing=create_missing, cache_dir=profile.cache_dir,
+                            all_playlist_id=profile.all_playlist_id)
+
+
+def check_profile(profile, spotify, update_cache=True):
+    from check_all import list_offending_tracks
+    from sort import PlaylistSorter
+    from update import update_cached_playlists
+
+    if update_cache:
+        update_cached_playlists(spotify, cache_dir=profile.cache_dir,
+                                all_playlist_id=profile.all_playlist_id)
+    sorter = PlaylistSorter(spotify, playback_start_position_ms=None, suggest_genres=False,
+                            cache_dir=profile.cache_dir, all_playlist_id=profile.all_playlist_id,
+                            all_playlist_name=profile.all_playlist_name)
+    list_offending_tracks(spotify, sorter)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["update", "check"],
+        help="update: like update.py; check: like check_all.py --list")
+    parser.add_argument("--profiles", "-p", nargs="+", default=None,
+        help="profiles to run for (default all)")
+    parser.add_argument("--create-missing", action="store_true", default=False,
+        help="with update, create playlists that don't already exist")
+    parser.add_argument("--skip-update-cache", '-v', action='store_false', default=True,
+        dest='update_cache',
+        help="with check, skip updating the cache")
+    args = parser.parse_args()
+
+    import tekore
+
+    profiles = load_profiles()
+    if args.profiles:
+        unknown = [name for name in args.profiles if name not in profiles]
+        if unknown:
+            print(f"\033[0;33mNo profile called {', '.join(unknown)} "
+                  f"(choices: {', '.join(profiles.keys())})\033[0m")
+            exit(1)
+        profiles = {name: profiles[name] for name in args.profiles}
+
+    if args.command == "update":
+        scope = tekore.scope.playlist_read_private
+        if args.create_missing:
+            scope += tekore.scope.playlist_modify_private
+        job, kwargs = update_profile, {'create_missing': args.create_missing}
+    else:
+        scope = tekore.scope.playlist_read_private
+        job, kwargs = check_profile, {'update_cache': args.update_cache}
+
+    spotifies = {name: profile.get_spotify_object(scope=scope) for name, profile in profiles.items()}
+
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(profiles)) as executor:
+            futures = {executor.submit(output.capture, job, profile, spotifies[name], **kwargs): name
+                       for name, profile in profiles.items()}
+            for future in concurrent.futures.as_completed(futures):
+                print(f"\033[1;36m━━ {futures[future]} ━━\033[0m")
+                print(future.result())
+    finally:
+        sys.stdout = output.stdout
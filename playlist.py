@@ -1,83 +1,185 @@
-"""Retrieves and displays a given Spotify playlist with relevant additional data."""
+"""Retrieves and displays given Spotify playlists with relevant additional data.
+
+Several playlists, or all playlists in a category, can be shown in one go,
+either in separate sections or (with --combined) as one table of all their
+tracks. Tracks are often in several of them, so audio features are fetched only
+once for each track."""
 
 import argparse
+import os.path
 
+import daemon_client
 from cached import CachedPlaylistGroup
-from utils import (format_artists, format_release_date, format_tempo,
-                   get_spotify_object, parse_playlist_arg)
-
-parser = argparse.ArgumentParser(description=__doc__)
-parser.add_argument('playlist', nargs='?',
-    help="playlist to show, specify by either name or ID")
-parser.add_argument('--no-bpm-clip', '-B', default=True, action='store_false', dest='bpm_clip',
-    help="don't clip BPMs to be between 60 and 140")
-parser.add_argument('--release-date-precision', '-r', default='year', choices=['year', 'month', 'day'],
-    help="display release date to this level of precision")
-parser.add_argument("--tekore-cfg", '-T', type=str, default='tekore.cfg',
-    help="file to use to store Tekore (Spotify) user token")
-args = parser.parse_args()
-
-
-def get_tracks_info(items):
-    items = list(items)
-    track_ids = [item.track.id for item in items if item.track.id is not None]
+from categories import CATEGORIES
+from profiles import add_profile_argument, get_profile
+from utils import format_artists, format_release_date, format_tempo, parse_playlist_arg
+
+
+def fetch_features(sp, track_ids):
+    """Returns a dict mapping each of `track_ids` to its audio features, fetching
+    each track's features once, in as few requests as possible."""
+    track_ids = list(dict.fromkeys(track_ids))
     with sp.chunked(True):
         features = sp.tracks_audio_features(track_ids)
-    features_by_track_id = {feature.id: feature for feature in features}
+    return {feature.id: feature for feature in features if feature is not None}
+
 
+def get_tracks_info(items, features_by_track_id, tempo_playlists, genre_playlists, bpm_clip=True,
+                    release_date_precision='year'):
     infos = []
     for item in items:
         track = item.track
-        info = format_track_info(track)
+        info = format_track_info(track, tempo_playlists, genre_playlists, release_date_precision)
         features = features_by_track_id.get(track.id)
-        info['tempo'] = format_tempo(features.tempo, clip=args.bpm_clip) if features else "- "
+        info['tempo'] = format_tempo(features.tempo, clip=bpm_clip) if features else "- "
         info['added_at'] = item.added_at
         infos.append(info)
 
     return infos
 
 
-def format_track_info(track):
+def format_track_info(track, tempo_playlists, genre_playlists, release_date_precision='year'):
     info = {
         'name': track.name,
         'artist': format_artists(track.artists),
         'tempo_range': tempo_playlists.playlists_containing_track_str(track.id, sep=" "),
-        'release': format_release_date(track.album.release_date, args.release_date_precision),
+        'release': format_release_date(track.album.release_date, release_date_precision),
         'genres': genre_playlists.playlists_containing_track_str(track.id),
     }
     return info
 
 
-tempo_playlists = CachedPlaylistGroup.from_filename('tempo.json')
-genre_playlists = CachedPlaylistGroup.from_filename('genre.json')
-sp = get_spotify_object(args.tekore_cfg)
-
-if args.playlist:
-    playlist_id = parse_playlist_arg(args.playlist)
-else:
+def get_currently_playing_playlist_id(sp):
+    """Returns the ID of the playlist that is currently playing, or exits if
+    there isn't one."""
     playing = sp.playback()
-    if not playing.context:
+    if not playing or not playing.context:
         print("\033[0;33mNot currently playing in a context.\033[0m")
         print("Specify a playlist by name or URI to see info about it.")
         exit(1)
     elif playing.context.type == 'playlist':
-        playlist_id = playing.context.uri.rsplit(':', maxsplit=1)[-1]
         print("\033[1;32mCurrently playing:\033[0m")
+        return playing.context.uri.rsplit(':', maxsplit=1)[-1]
     else:
         print("\033[0;33mCurrently playing context isn't a playlist."
               f"\033[0m (found: {playing.context.type})")
         print("Specify a playlist by name or URI to see info about it.")
         exit(1)
 
-playlist = sp.playlist(playlist_id)
-print(f"\033[1;36m{playlist.name}\033[0;36m spotify:playlist:{playlist.id}\033[0m")
-
-genre_playlists.remove_playlist(playlist.id)  # don't print the playlist that applies to all of them
-
-items = sp.all_items(playlist.tracks)
-infos = get_tracks_info(items)
 
-for i, info in enumerate(infos, start=1):
-    print(f"{i:3d} │ {info['name'][:35]:35s} │ {info['artist'][:25]:25s} │ "
-          f"{info['tempo_range']:>6s} {info['tempo']:>4s}│ "
-          f"{info['release']:^4s} │ {info['genres']:s}")
+def print_tracks_info(infos, extra_key=None):
+    for i, info in enumerate(infos, start=1):
+        extra = f" │ {info[extra_key]}" if extra_key else ""
+        print(f"{i:3d} │ {info['name'][:35]:35s} │ {info['artist'][:25]:25s} │ "
+              f"{info['tempo_range']:>6s} {info['tempo']:>4s}│ "
+              f"{info['release']:^4s} │ {info['genres']:s}{extra}")
+
+
+def show_playlists(sp, playlist_ids, tempo_playlists, genre_playlists, bpm_clip=True,
+                   release_date_precision='year', combined=False):
+    """Shows the playlists, each in its own section, or if `combined` is True, as
+    one table with a row for each track that's in any of them."""
+    playlists = []
+    items_by_playlist_id = {}
+    for playlist_id in dict.fromkeys(playlist_ids):
+        playlist = sp.playlist(playlist_id)
+        playlists.append(playlist)
+        items_by_playlist_id[playlist.id] = [item for item in sp.all_items(playlist.tracks)
+                                             if item.track is not None]
+
+    track_ids = [item.track.id for items in items_by_playlist_id.values() for item in items
+                 if item.track.id is not None]
+    features_by_track_id = fetch_features(sp, track_ids)
+
+    if not combined:
+        for i, playlist in enumerate(playlists):
+            if i > 0:
+                print()
+            print(f"\033[1;36m{playlist.name}\033[0;36m spotify:playlist:{playlist.id}\033[0m")
+
+            # don't print the playlist that applies to all of them
+            other_genre_playlists = CachedPlaylistGroup()
+            other_genre_playlists.add_playlists(p for p in genre_playlists if p.id != playlist.id)
+
+            infos = get_tracks_info(items_by_playlist_id[playlist.id], features_by_track_id,
+                    tempo_playlists, other_genre_playlists, bpm_clip, release_date_precision)
+            print_tracks_info(infos)
+        return
+
+    # Combined: one row per track, with a column saying which of these playlists it's in
+    shown_ids = {playlist.id for playlist in playlists}
+    other_genre_playlists = CachedPlaylistGroup()
+    other_genre_playlists.add_playlists(p for p in genre_playlists if p.id not in shown_ids)
+
+    unique_items = {}
+    in_playlists = {}
+    for playlist in playlists:
+        name = playlist.name[4:] if playlist.name.startswith("WCS ") else playlist.name
+        for item in items_by_playlist_id[playlist.id]:
+            key = item.track.id or item.track.uri
+            unique_items.setdefault(key, item)
+            in_playlists.setdefault(key, []).append(name)
+
+    for playlist in playlists:
+        print(f"\033[1;36m{playlist.name}\033[0;36m spotify:playlist:{playlist.id}\033[0m")
+    infos = get_tracks_info(unique_items.values(), features_by_track_id, tempo_playlists,
+                            other_genre_playlists, bpm_clip, release_date_precision)
+    for info, key in zip(infos, unique_items.keys()):
+        info['in'] = ", ".join(in_playlists[key])
+    print_tracks_info(infos, extra_key='in')
+
+
+def show_playlist(sp, playlist_id, tempo_playlists, genre_playlists, bpm_clip=True,
+                  release_date_precision='year'):
+    show_playlists(sp, [playlist_id], tempo_playlists, genre_playlists, bpm_clip,
+                   release_date_precision)
+
+
+def category_playlist_ids(category, cache_dir='.'):
+    filename = os.path.join(cache_dir, category + '.json')
+    return [playlist.id for playlist in CachedPlaylistGroup.from_filename(filename)]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('playlists', nargs='*',
+        help="playlists to show, specify by either name or ID (default currently playing)")
+    parser.add_argument('--category', '-c', choices=[filename[:-5] for filename in CATEGORIES.keys()],
+        action='append', default=[],
+        help="show all playlists in this category (can be used more than once)")
+    parser.add_argument('--combined', '-C', action='store_true', default=False,
+        help="show all tracks in one table, rather than a section for each playlist")
+    parser.add_argument('--no-bpm-clip', '-B', default=True, action='store_false', dest='bpm_clip',
+        help="don't clip BPMs to be between 60 and 140")
+    parser.add_argument('--release-date-precision', '-r', default='year',
+        choices=['year', 'month', 'day'],
+        help="display release date to this level of precision")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    add_profile_argument(parser)
+    daemon_client.add_daemon_arguments(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    if args.use_daemon:
+        status = daemon_client.query(args.socket, 'playlist', profile.name, playlists=args.playlists,
+                                     categories=args.category, combined=args.combined,
+                                     bpm_clip=args.bpm_clip,
+                                     release_date_precision=args.release_date_precision)
+        if status is not None:
+            exit(status)
+
+    tempo_playlists = CachedPlaylistGroup.from_filename(profile.path('tempo.json'))
+    genre_playlists = CachedPlaylistGroup.from_filename(profile.path('genre.json'))
+    sp = profile.get_spotify_object(args.tekore_cfg)
+
+    playlist_ids = [parse_playlist_arg(playlist, cache_dir=profile.cache_dir)
+                    for playlist in args.playlists]
+    for category in args.category:
+        playlist_ids.extend(category_playlist_ids(category, profile.cache_dir))
+    if not playlist_ids:
+        playlist_ids = [get_currently_playing_playlist_id(sp)]
+
+    show_playlists(sp, playlist_ids, tempo_playlists, genre_playlists, args.bpm_clip,
+                   args.release_date_precision, args.combined)
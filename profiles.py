@@ -0,0 +1,105 @@
+"""Profiles, for managing several libraries (e.g. different DJs' accounts) that
+use the same categories of playlists. Each profile has its own cache directory
+and Tekore token file, and can have its own "all" playlist and client
+credentials.
+
+Profiles are defined by PROFILES in settings.py (see settings.example). If it
+isn't there, there's just one profile, "default", which uses the current
+directory and the other settings in settings.py, as all scripts did before
+there were profiles."""
+
+import os
+
+DEFAULT_PROFILE_NAME = 'default'
+
+
+class Profile:
+
+    def __init__(self, name, cache_dir='.', tekore_cfg='tekore.cfg', all_playlist_id=None,
+                 all_playlist_name=None, removed_playlist_id=None, removed_playlist_name=None,
+                 credentials=None):
+        """`credentials` is a tuple `(client_id, client_secret, redirect_uri)`,
+        or None to use those in settings.py."""
+        self.name = name
+        self.cache_dir = cache_dir
+        self.tekore_cfg = tekore_cfg
+        self.all_playlist_id = all_playlist_id
+        self.all_playlist_name = all_playlist_name
+        self.removed_playlist_id = removed_playlist_id
+        self.removed_playlist_name = removed_playlist_name
+        self.credentials = credentials
+
+    def __repr__(self):
+        return f"Profile({self.name!r}, cache_dir={self.cache_dir!r})"
+
+    def path(self, filename):
+        """Returns the path to the cache file `filename` for this profile."""
+        return os.path.join(self.cache_dir, filename)
+
+    def get_spotify_object(self, tekore_cfg_file=None, scope=None, asynchronous=False):
+        from utils import get_spotify_object
+
+        tekore_cfg_file = tekore_cfg_file or self.tekore_cfg
+        os.makedirs(os.path.dirname(tekore_cfg_file) or '.', exist_ok=True)
+        return get_spotify_object(tekore_cfg_file, scope=scope, asynchronous=asynchronous,
+                                  credentials=self.credentials)
+
+
+def load_profiles():
+    """Returns a dict mapping profile names to `Profile`s, in the order they're
+    defined in settings.py."""
+    try:
+        import settings
+    except ImportError:
+        settings = None
+
+    all_playlist_id = getattr(settings, 'ALL_PLAYLIST_ID', None)
+    all_playlist_name = getattr(settings, 'ALL_PLAYLIST_NAME', None)
+    removed_playlist_id = getattr(settings, 'REMOVED_PLAYLIST_ID', None)
+    removed_playlist_name = getattr(settings, 'REMOVED_PLAYLIST_NAME', None)
+    definitions = getattr(settings, 'PROFILES', None)
+    if not definitions:
+        return {DEFAULT_PROFILE_NAME: Profile(DEFAULT_PROFILE_NAME, all_playlist_id=all_playlist_id,
+                                              all_playlist_name=all_playlist_name,
+                                              removed_playlist_id=removed_playlist_id,
+                                              removed_playlist_name=removed_playlist_name)}
+
+    profiles = {}
+    for name, options in definitions.items():
+        cache_dir = options.get('cache_dir', os.path.join('profiles', name))
+        credentials = None
+        if 'client_id' in options:
+            credentials = (options['client_id'], options['client_secret'], options['redirect_uri'])
+        profiles[name] = Profile(name,
+            cache_dir=cache_dir,
+            tekore_cfg=options.get('tekore_cfg', os.path.join(cache_dir, 'tekore.cfg')),
+            all_playlist_id=options.get('all_playlist_id', all_playlist_id),
+            all_playlist_name=options.get('all_playlist_name', all_playlist_name),
+            removed_playlist_id=options.get('removed_playlist_id', removed_playlist_id),
+            removed_playlist_name=options.get('removed_playlist_name', removed_playlist_name),
+            credentials=credentials)
+    return profiles
+
+
+def get_profile(name=None):
+    """Returns the profile called `name`, or if `name` is None, the only
+    profile. Exits if there's no such profile, or if `name` is None and there's
+    more than one."""
+    profiles = load_profiles()
+    if name is None:
+        if len(profiles) > 1:
+            print("\033[0;33mThere's more than one profile, use --profile to choose one "
+                  f"({', '.join(profiles.keys())})\033[0m")
+            exit(1)
+        return next(iter(profiles.values()))
+
+    try:
+        return profiles[name]
+    except KeyError:
+        print(f"\033[0;33mNo profile called \"{name}\" (choices: {', '.join(profiles.keys())})\033[0m")
+        exit(1)
+
+
+def add_profile_argument(parser):
+    parser.add_argument("--profile", "-P", type=str, default=None,
+        help="profile to use, if there are several in settings.py (see profiles.py)")
@@ -0,0 +1,320 @@
+"""Finds tracks by which playlists they're in, using the cache. Queries are
+boolean expressions of playlist names, for example:
+
+    query.py "blues and not @tempo"
+    query.py "2010s pop and 120bpm"
+    query.py "untested and not all"
+    query.py "(swung beat or blues) and not (pre-1990 pop or 1990s pop)"
+
+Operators are "and", "or", "not" and parentheses. Playlist names can be given
+without the "WCS " prefix, and can have spaces; put them in double quotes if
+they contain a keyword or parenthesis. "@tempo", "@genre", "@special" and
+"@status" mean "in any playlist in that category". "all" (the all playlist)
+isn't cached, so it's fetched if used.
+
+Prints a row for each track (using tracks.json from update.py, if available),
+or just the IDs with --ids, e.g. to pipe into `track.py --batch -`. With --sort,
+sorts the matching tracks, like check_all.py."""
+
+import argparse
+import re
+import time
+
+from cached import CachedPlaylist, CachedPlaylistGroup
+from categories import CATEGORIES
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+from utils import with_next
+
+KEYWORDS = ['and', 'or', 'not']
+
+
+class QueryError(Exception):
+    pass
+
+
+def tokenize(query):
+    """Returns a list of tokens: parentheses, keywords, category references
+    ('@' followed by the category) and playlist names. Consecutive words that
+    aren't keywords are joined into one name."""
+    tokens = []
+    joinable = False  # whether the last token is an unquoted name, which the next word continues
+    for match in re.finditer(r'\(|\)|"[^"]*"|[^\s()"]+|"', query):
+        word = match.group()
+        if word == '"':
+            raise QueryError("Unmatched double quote")
+
+        if word.startswith('"'):
+            tokens.append(('name', word[1:-1]))
+        elif word in "()":
+            tokens.append((word, word))
+        elif word.lower() in KEYWORDS:
+            tokens.append((word.lower(), word))
+        elif word.startswith('@'):
+            tokens.append(('category', word[1:]))
+        elif joinable:
+            tokens[-1] = ('name', tokens[-1][1] + " " + word)
+        else:
+            tokens.append(('name', word))
+            joinable = True
+            continue
+        joinable = False
+    return tokens
+
+
+class QueryParser:
+    """Recursive descent parser. Returns an expression tree of tuples:
+    ('or', a, b), ('and', a, b), ('not', a), ('name', name), ('category', category).
+    "not" binds tightest, then "and", then "or"."""
+
+    def __init__(self, query):
+        self.tokens = tokenize(query)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("Empty query")
+        tree = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise QueryError(f"Unexpected '{self.tokens[self.pos][1]}'")
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.peek() == 'or':
+            self.take()
+            tree = ('or', tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_not()
+        while self.peek() == 'and':
+            self.take()
+            tree = ('and', tree, self.parse_not())
+        return tree
+
+    def parse_not(self):
+        if self.peek() == 'not':
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind = self.peek()
+        if kind is None:
+            raise QueryError("Query ends unexpectedly")
+        if kind == '(':
+            self.take()
+            tree = self.parse_or()
+            if self.peek() != ')':
+                raise QueryError("Missing ')'")
+            self.take()
+            return tree
+        if kind in ['name', 'category']:
+            return self.take()
+        raise QueryError(f"Unexpected '{self.tokens[self.pos][1]}'")
+
+
+def referenced_names(tree):
+    if tree[0] == 'name':
+        return [tree[1]]
+    if tree[0] == 'category':
+        return []
+    return [name for subtree in tree[1:] for name in referenced_names(subtree)]
+
+
+class MembershipIndex:
+    """Each track gets a bit position, and each playlist a bitmap (a Python
+    int) of the tracks in it, so that a query is a few big-integer operations,
+    whatever the size of the library."""
+
+    def __init__(self, playlists):
+        self.track_ids = []
+        position = {}
+        for playlist in playlists:
+            for track_id in playlist.track_ids:
+                if track_id not in position:
+                    position[track_id] = len(self.track_ids)
+                    self.track_ids.append(track_id)
+
+        nbytes = (len(self.track_ids) + 7) // 8
+        self.bitmaps = {}  # playlist id: bitmap
+        for playlist in playlists:
+            bits = bytearray(nbytes)
+            for track_id in playlist.track_ids:
+                i = position[track_id]
+                bits[i >> 3] |= 1 << (i & 7)
+            self.bitmaps[playlist.id] = int.from_bytes(bits, 'little')
+        self.universe = (1 << len(self.track_ids)) - 1
+
+    def union(self, playlists):
+        bitmap = 0
+        for playlist in playlists:
+            bitmap |= self.bitmaps[playlist.id]
+        return bitmap
+
+    def track_ids_in(self, bitmap):
+        """Returns the track IDs in `bitmap`, in the order they were indexed."""
+        bits = bin(bitmap)[:1:-1]  # least significant bit first
+        return [self.track_ids[i] for i, bit in enumerate(bits) if bit == '1']
+
+
+class QueryEngine:
+
+    def __init__(self, groups, all_playlist=None):
+        """`groups` maps category names (like 'tempo') to `CachedPlaylistGroup`s.
+        `all_playlist`, if given, is a `CachedPlaylist` that can be called "all"."""
+        self.groups = groups
+        self.all_playlist = all_playlist
+        self.playlists = [playlist for group in groups.values() for playlist in group]
+        if all_playlist is not None:
+            self.playlists.append(all_playlist)
+        self.index = MembershipIndex(self.playlists)
+
+    def find_playlist(self, name):
+        if self.all_playlist is not None and name.lower() in ["all", self.all_playlist.name.lower()]:
+            return self.all_playlist
+        playlist = find_playlist_by_name(self.playlists, name)
+        if playlist is None:
+            raise QueryError(f"No playlist called \"{name}\" in the cache")
+        return playlist
+
+    def evaluate(self, tree):
+        kind = tree[0]
+        if kind == 'or':
+            return self.evaluate(tree[1]) | self.evaluate(tree[2])
+        if kind == 'and':
+            return self.evaluate(tree[1]) & self.evaluate(tree[2])
+        if kind == 'not':
+            return self.index.universe & ~self.evaluate(tree[1])
+        if kind == 'category':
+            if tree[1] not in self.groups:
+                raise QueryError(f"No category called \"{tree[1]}\" "
+                                 f"(choices: {', '.join(self.groups.keys())})")
+            return self.index.union(self.groups[tree[1]])
+        if kind == 'name':
+            return self.index.bitmaps[self.find_playlist(tree[1]).id]
+        raise ValueError(f"Invalid expression: {tree}")
+
+    def query(self, query):
+        """Returns a list of the IDs of tracks matching `query`. "not" means
+        "in some indexed playlist, but not ..."."""
+        return self.index.track_ids_in(self.evaluate(QueryParser(query).parse()))
+
+
+def find_playlist_by_name(playlists, name):
+    """Like `CachedPlaylistGroup.playlist_by_name()`, but if there's no exact
+    match, also tries ignoring case."""
+    group = CachedPlaylistGroup()
+    group.add_playlists(playlists)
+    playlist = group.playlist_by_name(name)
+    if playlist is not None:
+        return playlist
+    for playlist in playlists:
+        if playlist.name.lower() in [name.lower(), "wcs " + name.lower()]:
+            return playlist
+    return None
+
+
+def needs_all_playlist(tree, groups):
+    """Returns True if the query refers to "all", and it isn't a cached playlist."""
+    playlists = [playlist for group in groups.values() for playlist in group]
+    return any(name.lower() in ["all", "wcs all"] and find_playlist_by_name(playlists, name) is None
+               for name in referenced_names(tree))
+
+
+def print_rows(track_ids, engine, track_info):
+    group = CachedPlaylistGroup()
+    group.add_playlists(engine.playlists)
+    for i, track_id in enumerate(track_ids, start=1):
+        info = track_info.get(track_id)
+        if info:
+            name = info['name']
+            artists = ", ".join(artist_name for artist_id, artist_name in info['artists'])
+            release = (info['release_date'] or "-")[:4]
+        else:
+            name, artists, release = track_id, "", "-"
+        print(f"{i:3d} │ {name[:35]:35s} │ {artists[:25]:25s} │ {release:^4s} │ "
+              f"{group.playlists_containing_track_str(track_id)}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query",
+        help="boolean expression of playlist names, e.g. \"blues and not @tempo\"")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--ids", action="store_true", default=False,
+        help="print only track IDs, one per line")
+    output.add_argument("--sort", action="store_true", default=False,
+        help="sort the matching tracks")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    parser.add_argument("--playback-start", '-s', type=float, default=15,
+        help="with --sort, start playback this far through the song (default 15)")
+    parser.add_argument("--browser", type=str, default="wslview",
+        help="with --sort, browser to open searches in (default wslview)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    groups = {filename[:-5]: CachedPlaylistGroup.from_filename(profile.path(filename))
+              for filename in CATEGORIES.keys()}
+    sp = None
+
+    try:
+        tree = QueryParser(args.query).parse()
+        all_playlist = None
+        if needs_all_playlist(tree, groups) or args.sort:
+            import tekore
+
+            scope = tekore.Scope()
+            if args.sort:
+                scope += tekore.scope.user_modify_playback_state + tekore.scope.playlist_modify_public
+            sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+            all_playlist = CachedPlaylist.from_playlist_id(profile.all_playlist_id, sp,
+                    expected_name=profile.all_playlist_name)
+
+        start = time.perf_counter()
+        engine = QueryEngine(groups, all_playlist)
+        track_ids = engine.index.track_ids_in(engine.evaluate(tree))
+        elapsed = time.perf_counter() - start
+    except QueryError as e:
+        print(f"\033[0;33m{e}\033[0m")
+        exit(1)
+
+    if args.ids:
+        for track_id in track_ids:
+            print(track_id)
+        exit(0)
+
+    if not args.sort:
+        print_rows(track_ids, engine, TrackInfoCache.from_filename(profile.path(TRACKS_FILENAME)))
+        print(f"\033[0;90m{len(track_ids)} tracks ({elapsed * 1000:.1f} ms)\033[0m")
+        exit(0)
+
+    from sort import PlaylistSorter
+
+    sorter = PlaylistSorter(sp,
+        prompt_for_all=True,
+        playback_start_position_ms=args.playback_start * 1000,
+        browser=args.browser,
+        cache_dir=profile.cache_dir)
+    sorter.all_playlist = all_playlist  # already fetched
+
+    with sp.chunked(True):
+        tracks = sp.tracks(track_ids)
+    print(f"{len(tracks)} tracks match.\n")
+    sorter.prefetch_tracks_info(tracks)
+    for track, next_track in with_next(tracks):
+        sorter.sort_track(track, next_track=next_track)
+        print()
@@ -8,29 +8,51 @@ import datetime
 import json
 
 from categories import CATEGORIES
-from settings import ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME, REMOVED_PLAYLIST_ID, REMOVED_PLAYLIST_NAME
-from utils import format_artists, get_spotify_object
+from profiles import add_profile_argument, get_profile
+from utils import batches, format_artists
 
 parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False)
 parser.add_argument('--confirm-remove', action='store_true', default=False,
     help="actually remove the tracks")
-parser.add_argument('--output-file', '-O', default='removed.log', type=argparse.FileType('a'),
-    help="record removed tracks here (used only if --confirm-remove specified)")
-parser.add_argument("--tekore-cfg", '-T', type=str, default='tekore.cfg',
-    help="file to use to store Tekore (Spotify) user token")
+parser.add_argument('--output-file', '-O', default=None, type=str,
+    help="record removed tracks here (used only if --confirm-remove specified) "
+         "(default removed.log in the profile's cache directory)")
+parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+    help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+add_profile_argument(parser)
 args = parser.parse_args()
 
-sp = get_spotify_object(args.tekore_cfg)
+profile = get_profile(args.profile)
+if profile.removed_playlist_id is None:
+    print("Error: Before using this, copy settings.example to settings.py and fill in its blanks")
+    exit(1)
 
-removed_playlist = sp.playlist(REMOVED_PLAYLIST_ID)
-assert removed_playlist.name == REMOVED_PLAYLIST_NAME
+sp = profile.get_spotify_object(args.tekore_cfg)
+output_file = open(args.output_file or profile.path('removed.log'), 'a') if args.confirm_remove else None
 
-removed_items = list(sp.all_items(removed_playlist.tracks))
-removed_track_ids = {item.track.id for item in removed_items}
-removed_track_playlists = {track_id: [] for track_id in removed_track_ids}
+removed_playlist = sp.playlist(profile.removed_playlist_id)
+assert removed_playlist.name == profile.removed_playlist_name
+
+# Playlist items are consumed a page at a time as they arrive, keeping only what's
+# needed: the name and artists of each removed track, and for other playlists,
+# just the removed tracks they contain.
+removed_tracks = {}  # track_id: description
+for item in sp.all_items(removed_playlist.tracks):
+    if item.track is not None and item.track.id is not None:
+        removed_tracks[item.track.id] = f"\"{item.track.name}\" ({format_artists(item.track.artists)})"
+nfound = 0
+
+
+def log_output(message):
+    print(message)
+    if args.confirm_remove:
+        output_file.write(message + "\n")
+        output_file.flush()
 
 
 def handle_playlist(playlist_id, playlist_name):
+    global nfound
+
     playlist = sp.playlist(playlist_id)
     if playlist_name != playlist.name:
         print(f"Playlist names don't match: expected name {playlist_name}, actual name {playlist.name}")
@@ -39,51 +61,41 @@ def handle_playlist(playlist_id, playlist_name):
     print(" " * 80, end="\r")
     print(f"Checking playlist: {playlist_name}...", end="\r")
 
-    playlist_items = sp.all_items(playlist.tracks)
-    playlist_track_ids = {item.track.id for item in playlist_items}
-    found_in_playlist = removed_track_ids & playlist_track_ids
-
+    found_in_playlist = list(dict.fromkeys(
+        item.track.id for item in sp.all_items(playlist.tracks)
+        if item.track is not None and item.track.id in removed_tracks))
     if not found_in_playlist:
         return
 
-    for track_id in found_in_playlist:
-        removed_track_playlists[track_id].append((playlist_id, playlist_name))
-
     if args.confirm_remove:
-        sp.playlist_remove(playlist_id, ["spotify:track:" + track_id for track_id in found_in_playlist])
+        for batch in batches(found_in_playlist):
+            sp.playlist_remove(playlist_id, ["spotify:track:" + track_id for track_id in batch])
 
-
-def log_output(message):
-    print(message)
-    if args.confirm_remove:
-        args.output_file.write(message + "\n")
+    # Log as we go, so that if something goes wrong later, the log still shows
+    # what was removed.
+    remove_string = "Removed" if args.confirm_remove else "Would remove"
+    print(" " * 80, end="\r")
+    log_output(f"{remove_string} from [{playlist_id}] {playlist_name}:")
+    for track_id in found_in_playlist:
+        log_output(f" - [{track_id}] {removed_tracks[track_id]}")
+    nfound += len(found_in_playlist)
 
 
 log_output("=== " + datetime.datetime.now().isoformat() + " ===")
 
-handle_playlist(ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME)
+handle_playlist(profile.all_playlist_id, profile.all_playlist_name)
 
 for filename in CATEGORIES.keys():
-    playlists = json.load(open(filename))
+    fp = open(profile.path(filename))
+    playlists = json.load(fp)
+    fp.close()
     for playlist in playlists:
-        if playlist['id'] == REMOVED_PLAYLIST_ID:
+        if playlist['id'] == profile.removed_playlist_id:
             continue
         handle_playlist(playlist['id'], playlist['name'])
 
-for item in removed_items:
-    if len(removed_track_playlists[item.track.id]) == 0:
-        continue
-
-    remove_string = "Removed" if args.confirm_remove else "Would remove"
-    log_output("{remove_string} [{track_id}] \"{name}\" ({artist}), which was in:".format(
-        remove_string=remove_string,
-        name=item.track.name,
-        artist=format_artists(item.track.artists),
-        track_id=item.track.id,
-    ))
-    for playlist_id, playlist_name in removed_track_playlists[item.track.id]:
-        log_output(f" - [{playlist_id}] {playlist_name}")
-
+print(" " * 80, end="\r")
+log_output(f"{nfound} removals in total")
 log_output("")
 
 if not args.confirm_remove:
@@ -0,0 +1,179 @@
+"""Reorders a playlist by an audio feature (like tempo or energy), release date or
+date added, in place. Tracks aren't removed and re-added, so dates added are
+kept, and only the tracks that are out of place are moved.
+
+The tracks that can stay where they are form the longest subsequence of the
+current order that's already in the target order. Every other track is moved
+once, and runs of tracks that are next to each other both before and after
+are moved together, in one request. Tracks without the value (e.g. without
+audio features, or local files) go at the end, in their current order.
+
+Audio features come from features.json (see update.py); any that are missing
+are fetched. Runs a dry run (i.e. does not change anything) by default. Use
+--confirm-reorder to actually reorder the playlist."""
+
+import argparse
+import bisect
+
+from features import AudioFeaturesCache, DEFAULT_FILENAME as FEATURES_FILENAME, FEATURE_NAMES
+from profiles import add_profile_argument, get_profile
+from utils import format_artists, parse_playlist_arg
+
+DATE_KEYS = ['release_date', 'added_at']
+
+
+def target_order(keys, reverse=False):
+    """Returns the current positions (indices into `keys`) in the order they
+    should be in. Positions with a key of None go last. The sort is stable, so
+    ties stay in their current order."""
+    known = [i for i, key in enumerate(keys) if key is not None]
+    unknown = [i for i, key in enumerate(keys) if key is None]
+    return sorted(known, key=lambda i: keys[i], reverse=reverse) + unknown
+
+
+def longest_increasing_subsequence(sequence):
+    """Returns the set of indices of a longest strictly increasing subsequence
+    of `sequence`, in O(n log n) time."""
+    tails = []        # tails[k]: value ending the best subsequence of length k+1 found so far
+    tail_indices = []
+    previous = [None] * len(sequence)
+    for i, value in enumerate(sequence):
+        k = bisect.bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[k] = value
+            tail_indices[k] = i
+        previous[i] = tail_indices[k - 1] if k > 0 else None
+
+    indices = set()
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.add(i)
+        i = previous[i]
+    return indices
+
+
+def plan_moves(ranks):
+    """`ranks[i]` is where the track now at position `i` should end up. Returns
+    a list of `(range_start, insert_before, range_length)` moves, as for
+    Spotify's reorder endpoint, that put every track in place when applied in
+    order. Tracks in a longest increasing subsequence of `ranks` aren't moved.
+    Each other track is moved to just after the track that should precede it,
+    in order of rank, so that everything already moved or left alone stays in
+    order; a run of such tracks with consecutive ranks is moved together."""
+    order = list(ranks)
+    settled = [False] * len(order)
+    for i in longest_increasing_subsequence(order):
+        settled[order[i]] = True
+
+    moves = []
+    for rank in range(len(order)):
+        if settled[rank]:
+            continue
+        start = order.index(rank)
+        length = 1
+        while start + length < len(order) and order[start + length] == rank + length \
+                and not settled[rank + length]:
+            length += 1
+        insert_before = order.index(rank - 1) + 1 if rank > 0 else 0
+        for r in range(rank, rank + length):
+            settled[r] = True
+        if insert_before == start:
+            continue  # earlier moves have already put it in place
+
+        block = order[start:start + length]
+        del order[start:start + length]
+        destination = insert_before if insert_before < start else insert_before - length
+        order[destination:destination] = block
+        moves.append((start, insert_before, length))
+
+    assert order == sorted(order)
+    return moves
+
+
+def item_key(item, key, features_cache):
+    track = item.track
+    if track is None or track.id is None:
+        return None
+    if key == 'added_at':
+        return item.added_at.isoformat() if item.added_at else None
+    if key == 'release_date':
+        return track.album.release_date or None
+    return features_cache.get(track.id, key)
+
+
+def format_key(value, key):
+    if value is None:
+        return "-"
+    if key in DATE_KEYS:
+        return value[:10]
+    return f"{value:g}"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('playlist',
+        help="playlist to reorder, specify by either name or ID")
+    parser.add_argument('--by', '-b', choices=FEATURE_NAMES + DATE_KEYS, default='tempo',
+        help="what to order the tracks by (default tempo)")
+    parser.add_argument('--reverse', '-r', action='store_true', default=False,
+        help="order from highest or latest to lowest or earliest")
+    parser.add_argument('--confirm-reorder', action='store_true', default=False,
+        help="actually reorder the playlist")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    import tekore
+
+    scope = tekore.Scope(tekore.scope.playlist_read_private, tekore.scope.playlist_modify_public)
+    profile = get_profile(args.profile)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+
+    playlist = sp.playlist(parse_playlist_arg(args.playlist, cache_dir=profile.cache_dir))
+    items = list(sp.all_items(playlist.tracks))
+
+    features_cache = AudioFeaturesCache.from_filename(profile.path(FEATURES_FILENAME))
+    if args.by not in DATE_KEYS:
+        track_ids = [item.track.id for item in items
+                     if item.track is not None and item.track.id is not None]
+        if features_cache.fetch_missing(sp, track_ids):
+            features_cache.save_to_filename(profile.path(FEATURES_FILENAME))
+
+    keys = [item_key(item, args.by, features_cache) for item in items]
+    target = target_order(keys, args.reverse)
+    ranks = [None] * len(items)
+    for rank, position in enumerate(target):
+        ranks[position] = rank
+    moves = plan_moves(ranks)
+
+    print(f"{playlist.name}: {len(items)} tracks, "
+          f"{sum(length for start, before, length in moves)} to move in {len(moves)} requests")
+
+    if not args.confirm_reorder:
+        for rank, position in enumerate(target):
+            track = items[position].track
+            name = track.name if track is not None else "(unavailable)"
+            artists = format_artists(track.artists) if track is not None else ""
+            moved = f" \033[0;33m(was {position + 1})\033[0m" if position != rank else ""
+            print(f"{rank + 1:4d} │ {format_key(keys[position], args.by):>10s} │ "
+                  f"{name[:35]:35s} │ {artists[:25]:25s}{moved}")
+        if moves:
+            print("Use --confirm-reorder to follow through with these moves.")
+        exit(0)
+
+    # Each move is pinned to the snapshot the previous one produced, so if the
+    # playlist changes in the meantime, the rest of the moves fail rather than
+    # scrambling it.
+    snapshot_id = playlist.snapshot_id
+    for i, (start, insert_before, length) in enumerate(moves, start=1):
+        snapshot_id = sp.playlist_reorder(playlist.id, start, insert_before,
+                                          range_length=length, snapshot_id=snapshot_id)
+        print(f"\r\033[0;32m→ moved\033[0m {i} of {len(moves)}", end="", flush=True)
+    if moves:
+        print()
@@ -0,0 +1,237 @@
+"""Shared HTTP clients and Tekore senders.
+
+All API calls in a process go through one pooled, keep-alive `httpx` client (or
+one `httpx.AsyncClient` for asynchronous code), so that bulk operations reuse a
+small number of warm connections rather than setting up new ones. Requests also
+go through a retry layer that backs off on rate limiting (429) and transient
+errors, with a rate limiter shared by all requests so that concurrent requests
+slow down together. All of this can be tuned using `HTTP_OPTIONS` in
+settings.py; see settings.example."""
+
+import asyncio
+import atexit
+import functools
+import random
+import threading
+import time
+
+import httpx
+import tekore
+
+try:
+    from settings import HTTP_OPTIONS
+except ImportError:
+    HTTP_OPTIONS = {}
+
+
+DEFAULT_HTTP_OPTIONS = {
+    'http2': False,
+    'max_connections': 10,
+    'max_keepalive_connections': 10,
+    'keepalive_expiry': 60,
+    'timeout': 30,
+    'retries': 6,
+    'backoff_base': 1,
+    'backoff_max': 60,
+    'requests_per_second': 10,
+    'burst': 20,
+}
+
+# Errors that mean the request never reached the server, so it's always safe to
+# retry. Other transport errors are retried only for idempotent methods. PUT
+# isn't one here: reordering a playlist is a PUT that moves tracks by position,
+# so doing it twice moves them twice.
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'DELETE'}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+_clients = {}  # asynchronous: client
+
+
+@functools.lru_cache(maxsize=None)
+def http_options():
+    options = DEFAULT_HTTP_OPTIONS.copy()
+    options.update(HTTP_OPTIONS)
+
+    if options['http2']:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("\033[0;33mWarning: HTTP/2 needs the h2 package (pip install httpx[http2]), "
+                  "using HTTP/1.1\033[0m")
+            options['http2'] = False
+
+    return options
+
+
+def get_http_client(asynchronous=False):
+    """Returns the process-wide `httpx.Client` (or `httpx.AsyncClient`, if
+    `asynchronous` is True), creating it on first use. Both have the same pool
+    limits and protocol settings."""
+    if asynchronous not in _clients:
+        options = http_options()
+        limits = httpx.Limits(
+            max_connections=options['max_connections'],
+            max_keepalive_connections=options['max_keepalive_connections'],
+            keepalive_expiry=options['keepalive_expiry'],
+        )
+        client_class = httpx.AsyncClient if asynchronous else httpx.Client
+        _clients[asynchronous] = client_class(http2=options['http2'], limits=limits,
+                                              timeout=options['timeout'])
+    return _clients[asynchronous]
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter. Tokens are replenished at `rate`
+    per second, up to `capacity`. Each request takes a token, waiting until one
+    is available. `pause()` holds back all requests for a while, e.g. after the
+    API says we're being rate limited."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token and returns how long the caller must wait before using
+        it. The token count goes negative when requests are queued."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        time.sleep(self._reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self._reserve())
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class BackoffRetryingSender(tekore.ExtendingSender):
+    """Sender that retries requests that were rate limited, hit a transient
+    server error or couldn't connect. On 429 Too Many Requests, it honours the
+    Retry-After header and pauses the shared rate limiter, so every request in
+    the process waits, not just this one. Other errors are retried after a
+    jittered exponential backoff, but server errors and errors after a request
+    may have been sent only for idempotent methods."""
+
+    def __init__(self, sender=None, bucket=None, retries=6, backoff_base=1, backoff_max=60):
+        super().__init__(sender)
+        self.bucket = bucket
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_delay(self, request, attempt, response=None, error=None):
+        """Returns how long to wait before retrying, or None not to retry."""
+        if attempt >= self.retries:
+            return None
+
+        if error is not None:
+            if isinstance(error, UNSENT_REQUEST_ERRORS) or request.method in IDEMPOTENT_METHODS:
+                print(f"\033[0;33m△ {type(error).__name__}, retrying...\033[0m")
+                return self._backoff(attempt)
+            return None
+
+        if response.status_code == 429:
+            try:
+                # Tekore's senders pass on httpx's lowercased header names
+                headers = {key.lower(): value for key, value in response.headers.items()}
+                seconds = int(headers.get('retry-after', 1)) + 1
+            except ValueError:
+                seconds = self._backoff(attempt)
+            print(f"\033[0;33m△ Rate limited, waiting {seconds:.0f} seconds...\033[0m")
+            if self.bucket:
+                self.bucket.pause(seconds)
+            return seconds
+
+        # The server may have acted on the request before failing, so as with
+        # transport errors, only retry if doing it twice is harmless.
+        if response.status_code in TRANSIENT_STATUS_CODES and request.method in IDEMPOTENT_METHODS:
+            return self._backoff(attempt)
+
+        return None
+
+    def send(self, request):
+        if self.is_async:
+            return self._async_send(request)
+
+        attempt = 0
+        while True:
+            if self.bucket:
+                self.bucket.acquire()
+            try:
+                response = self.sender.send(request)
+            except httpx.TransportError as e:
+                delay = self._retry_delay(request, attempt, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(request, attempt, response=response)
+                if delay is None:
+                    return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def _async_send(self, request):
+        attempt = 0
+        while True:
+            if self.bucket:
+                await self.bucket.acquire_async()
+            try:
+                response = await self.sender.send(request)
+            except httpx.TransportError as e:
+                delay = self._retry_delay(request, attempt, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(request, attempt, response=response)
+                if delay is None:
+                    return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_bucket = None
+
+
+def get_rate_limiter():
+    """Returns the process-wide rate limiter."""
+    global _bucket
+    if _bucket is None:
+        options = http_options()
+        _bucket = TokenBucket(options['requests_per_second'], options['burst'])
+    return _bucket
+
+
+def get_sender(asynchronous=False):
+    """Returns a Tekore sender that uses the shared HTTP client, and retries
+    requests subject to the shared rate limiter."""
+    if asynchronous:
+        sender = tekore.AsyncSender(get_http_client(asynchronous=True))
+    else:
+        sender = tekore.SyncSender(get_http_client(asynchronous=False))
+
+    options = http_options()
+    return BackoffRetryingSender(sender, bucket=get_rate_limiter(), retries=options['retries'],
+            backoff_base=options['backoff_base'], backoff_max=options['backoff_max'])
+
+
+@atexit.register
+def close_http_client():
+    client = _clients.pop(False, None)
+    if client is not None:
+        client.close()
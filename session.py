@@ -0,0 +1,147 @@
+"""Checkpoints for long, interactive sorting runs (sort.py and check_all.py), so
+that they can be resumed with --resume after quitting or crashing, without
+refetching anything.
+
+A checkpoint records the queue of tracks to sort, what was decided for each
+track done so far, and the audio features and artists prefetched for them. It's
+rewritten after every track, to a temporary file that then replaces the old one,
+so a crash while writing can't leave a half-written checkpoint."""
+
+import datetime
+import json
+import os
+from typing import Dict, List
+
+
+class SortingSession:
+
+    filename: str
+    source: dict                # describes what's being sorted, to check on resume
+    queue: List[dict]           # {'track': serialized FullTrack, 'added_at': str or None}
+    decisions: Dict[str, str]   # track_id: decision
+    features: Dict[str, dict]   # track_id: serialized AudioFeatures
+    artists: Dict[str, dict]    # artist_id: serialized FullArtist
+
+    def __init__(self, filename, source, next_offset=None):
+        self.filename = filename
+        self.source = source
+        self.next_offset = next_offset  # where the next page of the source starts, if it's paged
+        self.queue = []
+        self.decisions = {}
+        self.features = {}
+        self.artists = {}
+
+    def __len__(self):
+        return len(self.queue)
+
+    @staticmethod
+    def _dump(model):
+        return model.model_dump(mode='json')
+
+    def extend_queue(self, tracks, added_ats=None):
+        if added_ats is None:
+            added_ats = [None] * len(tracks)
+        self.queue.extend({'track': self._dump(track),
+                           'added_at': added_at.isoformat() if added_at else None}
+                          for track, added_at in zip(tracks, added_ats))
+
+    def remaining(self):
+        """Yields `(track, added_at)` tuples for tracks without a decision yet.
+        Each track is yielded only once, even if it's in the queue more than once
+        and the caller looks ahead before recording the decision for it."""
+        from tekore.model import FullTrack
+
+        yielded = set()
+        for entry in self.queue:
+            track_id = entry['track']['id']
+            if track_id in self.decisions or track_id in yielded:
+                continue
+            yielded.add(track_id)
+            track = FullTrack.model_validate(entry['track'])
+            added_at = datetime.datetime.fromisoformat(entry['added_at']) if entry['added_at'] else None
+            yield track, added_at
+
+    def record(self, track_id, decision):
+        """Records the decision for a track and saves the checkpoint. Data for
+        the track that won't be needed again is dropped, so that the checkpoint
+        doesn't keep growing over a long session."""
+        self.decisions[track_id] = decision
+        for entry in self.queue:
+            if entry['track']['id'] == track_id:
+                entry['track'] = {'id': track_id}
+                entry['added_at'] = None
+        self.features.pop(track_id, None)
+        self.save()
+
+    def store_prefetched(self, sorter):
+        """Stores the audio features and artists `sorter` (a `PlaylistSorter`)
+        has fetched, other than those already stored or no longer needed."""
+        for track_id, features in sorter.audio_features_cache.items():
+            if track_id not in self.features and track_id not in self.decisions and features is not None:
+                self.features[track_id] = self._dump(features)
+        for artist_id, artist in sorter.artists_cache.items():
+            if artist_id not in self.artists:
+                self.artists[artist_id] = self._dump(artist)
+
+    def restore_prefetched(self, sorter):
+        from tekore.model import AudioFeatures, FullArtist
+
+        sorter.audio_features_cache.update({track_id: AudioFeatures.model_validate(data)
+                                            for track_id, data in self.features.items()})
+        sorter.artists_cache.update({artist_id: FullArtist.model_validate(data)
+                                     for artist_id, data in self.artists.items()})
+
+    def save(self):
+        data = {
+            'source': self.source,
+            'next_offset': self.next_offset,
+            'queue': self.queue,
+            'decisions': self.decisions,
+            'features': self.features,
+            'artists': self.artists,
+        }
+        tmp_filename = self.filename + '.tmp'
+        fp = open(tmp_filename, 'w')
+        json.dump(data, fp)
+        fp.close()
+        os.replace(tmp_filename, self.filename)
+
+    def finish(self):
+        """Deletes the checkpoint, since the session is done."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    @classmethod
+    def from_filename(cls, filename):
+        """Returns the session in `filename`, or None if there isn't one."""
+        if not os.path.exists(filename):
+            return None
+        fp = open(filename)
+        data = json.load(fp)
+        fp.close()
+        obj = cls(filename, data['source'], data.get('next_offset'))
+        obj.queue = data['queue']
+        obj.decisions = data['decisions']
+        obj.features = data['features']
+        obj.artists = data['artists']
+        return obj
+
+
+def start_or_resume(filename, source, resume, next_offset=None):
+    """Returns a tuple `(session, resumed)`. If `resume` is True and there's a
+    checkpoint in `filename` for the same `source`, that session is returned;
+    otherwise a new, empty one is, starting at `next_offset` if the source is
+    paged."""
+    if resume:
+        session = SortingSession.from_filename(filename)
+        if session is None:
+            print(f"\033[0;33mNo session to resume in {filename}, starting a new one\033[0m")
+        elif session.source != source:
+            print(f"\033[0;33mSession in {filename} was for something else, starting a new one\033[0m")
+        else:
+            print(f"\033[1;34mResuming session: {len(session.decisions)} of {len(session)} "
+                  f"tracks done\033[0m\n")
+            return session, True
+    elif os.path.exists(filename):
+        print("\033[0;33mStarting a new session (use --resume to continue the last one)\033[0m")
+    return SortingSession(filename, source, next_offset), False
@@ -4,25 +4,28 @@ be added to "WCS all", one of the WCS tempo playlists, and one or more of the
 WCS genre playlists."""
 
 import argparse
-import json
+import concurrent.futures
+import functools
+import os.path
 import subprocess
-import time
 import urllib.parse
 
-import httpx
-import tekore
-
 import cached
-from settings import ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME
-from utils import (clip_tempo, format_artists, format_duration_ms, format_key,
-                   get_spotify_object, get_yes_no_input, input_with_commands,
-                   parse_playlist_arg)
+from hints import GenreHintModel, HINTS_FILENAME
+from profiles import add_profile_argument, get_profile
+from session import start_or_resume
+from utils import (clip_tempo, decade_pop_playlist_name, format_artists, format_duration_ms,
+                   format_key, get_yes_no_input, input_with_commands, parse_playlist_arg, with_next)
+
+
+SESSION_FILENAME = 'sort.{playlist_id}.session.json'  # one per playlist, so sessions can run in parallel
+PAGE_SIZE = 100  # maximum number of items per playlist_items request
 
 
 def update_cache(filename, playlists):
-    fp = open(filename, 'w')
-    json.dump(playlists.serialize(), fp, indent=2)
-    fp.close()
+    """Saves changes to `playlists`, merging them with changes that other
+    sorting sessions might have saved meanwhile."""
+    playlists.merge_and_save(filename)
 
 
 class SkipTrack(Exception):
@@ -39,7 +42,8 @@ class PlaylistSorter:
 
     def __init__(self, spotify, prompt_for_all=False, if_already_sorted="prompt",
                  playback_start_position_ms=15000, browser=None, more_features=False,
-                 markets=['NZ', 'US', 'AU', 'FR']):
+                 markets=['NZ', 'US', 'AU', 'FR'], suggest_genres=True, queue_next=False,
+                 cache_dir='.', all_playlist_id=None, all_playlist_name=None):
         """
         `spotify` should be a tekore.Spotify object.
         `prompt_for_all` specifies whether the user should be prompted about
@@ -51,6 +55,17 @@ class PlaylistSorter:
         `browser` is the name of the browser to start for internet searches, or
             `None` not to open a browser.
         `more_features` is whether to print more audio features than just tempo.
+        `suggest_genres` is whether to suggest genre playlists based on similar
+            tracks' audio features (needs features.json, see update.py).
+        `queue_next` is whether to add the next track to the playback queue
+            when starting playback, so that it plays next if the current track
+            ends while you're still sorting. When it's then time to sort (or
+            not sort) the queued track, playback skips to it rather than
+            starting it again, so that it doesn't stay in the queue.
+        `cache_dir` is the directory with the cache files, and
+            `all_playlist_id` and `all_playlist_name` identify the all playlist
+            (see profiles.py); if `all_playlist_id` is None, those in
+            settings.py are used.
         """
         self.spotify = spotify
         self.prompt_for_all = prompt_for_all
@@ -61,15 +76,22 @@ class PlaylistSorter:
         self.browser = browser
         self.more_features = more_features
         self.markets = markets
+        self.suggest_genres = suggest_genres
+        self.queue_next = queue_next
+        self.queued_track_id = None  # track added to the playback queue, not yet skipped to
+        self.cache_dir = cache_dir
+        self.all_playlist_id = all_playlist_id
+        self.all_playlist_name = all_playlist_name
+        self.playback_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         self.audio_features_cache = {}
         self.artists_cache = {}
         self.set_up_playlist_cache()
 
     def set_up_playlist_cache(self):
-        self.tempo_playlists = cached.CachedPlaylistGroup.from_filename('tempo.json')
-        self.genre_playlists = cached.CachedPlaylistGroup.from_filename('genre.json')
-        self.all_playlist = cached.CachedPlaylist.from_playlist_id(ALL_PLAYLIST_ID,
-                self.spotify, expected_name=ALL_PLAYLIST_NAME)
+        """Nothing is loaded here; each category's cache file is loaded when
+        it's first used, and "WCS all" is fetched when it's first used."""
+        self.tempo_playlists = cached.LazyCachedPlaylistGroup(self.cache_path('tempo.json'))
+        self.genre_playlists = cached.LazyCachedPlaylistGroup(self.cache_path('genre.json'))
 
         # A little hacky - make a CachedPlaylistGroup containing all the other
         # playlists. It's preferable to use the same playlists, so that the
@@ -78,15 +100,48 @@ class PlaylistSorter:
         # little after construction to get it to run particular checks, so this
         # shouldn't automatically be kept "in sync" with the tempo and genre
         # playlist groups.
-        self.all_cached_playlists = cached.CachedPlaylistGroup()
-        self.all_cached_playlists.add_playlists(self.tempo_playlists)
-        self.all_cached_playlists.add_playlists(self.genre_playlists)
-        self.all_cached_playlists.add_from_filename('special.json')
-        self.all_cached_playlists.add_from_filename('status.json')
-        self.all_cached_playlists.add_playlist(self.all_playlist)
+        self.all_cached_playlists = cached.LazyCachedPlaylistGroup(
+            lambda: self.tempo_playlists,
+            lambda: self.genre_playlists,
+            self.cache_path('special.json'),
+            self.cache_path('status.json'),
+            lambda: [self.all_playlist],
+        )
+
+    @functools.cached_property
+    def all_playlist(self):
+        if self.all_playlist_id is None:
+            from settings import ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME
+            self.all_playlist_id, self.all_playlist_name = ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME
+        return cached.CachedPlaylist.from_playlist_id(self.all_playlist_id, self.spotify,
+                expected_name=self.all_playlist_name)
+
+    @functools.cached_property
+    def filing_index(self):
+        """Built when first used, then kept up to date as playlists change."""
+        return cached.FilingIndex(self.tempo_playlists, self.genre_playlists, self.all_playlist)
+
+    @functools.cached_property
+    def genre_suggester(self):
+        return self.set_up_genre_suggester() if self.suggest_genres else None
+
+    @functools.cached_property
+    def genre_hints(self):
+        return GenreHintModel.from_filename(self.cache_path(HINTS_FILENAME))
+
+    def set_up_genre_suggester(self):
+        from features import DEFAULT_FILENAME as FEATURES_FILENAME, AudioFeaturesCache
+        from suggest import GenreSuggester
+
+        features_cache = AudioFeaturesCache.from_filename(self.cache_path(FEATURES_FILENAME))
+        if len(features_cache) == 0:
+            return None
+        return GenreSuggester(features_cache, self.genre_playlists)
 
     def prefetch_tracks_info(self, tracks):
         """Pre-fetch audio features and artists of many tracks."""
+        if not tracks:
+            return
         track_ids = [track.id for track in tracks]
         artist_ids = [artist.id for track in tracks for artist in track.artists]
         with self.spotify.chunked(True):
@@ -95,64 +150,116 @@ class PlaylistSorter:
         self.audio_features_cache.update({feature.id: feature for feature in features})
         self.artists_cache.update({artist.id: artist for artist in artists})
 
-    def sort_track(self, track, added_at=None):
+    def sort_track(self, track, added_at=None, next_track=None):
         """Main entry point. Sorts the track.
-        If `added_at` is provided, it should be the time the track was added."""
+        If `added_at` is provided, it should be the time the track was added.
+        If `next_track` is provided, it's the track that will be sorted next.
+        Returns what happened: "sorted", "skipped" or "already sorted"."""
         self.show_track_info(track, added_at)
         self.show_existing_playlists(track)
-        if self.check_if_want_to_sort(track):
-            if self.playback_start_position_ms is not None:
-                self.spotify.playback_start_tracks([track.id],
-                    position_ms=self.playback_start_position_ms)
-            try:
-                self.add_to_tempo_playlist(track)
-                self.add_to_genre_playlist(track)
-                self.add_to_wcs_all(track)
-            except SkipTrack:
-                print("\033[0;35m◁ Skipping this track\033[0m")
+        if not self.check_if_want_to_sort(track):
+            self.skip_queued_track(track)
+            return "already sorted"
+        self.start_playback(track, next_track)
+        try:
+            self.add_to_tempo_playlist(track)
+            self.add_to_genre_playlist(track)
+            self.add_to_wcs_all(track)
+        except SkipTrack:
+            print("\033[0;35m◁ Skipping this track\033[0m")
+            return "skipped"
+        return "sorted"
 
     def sort_item(self, item):
         """Alternative entry point if the playlist item object is available."""
-        self.sort_track(item.track, added_at=item.added_at)
+        return self.sort_track(item.track, added_at=item.added_at)
+
+    def start_playback(self, track, next_track=None):
+        """Starts playing the track (and queues `next_track`, if `queue_next` is
+        set) on a background thread, so that sorting doesn't wait for the
+        player. Playback requests run one at a time, in order. If one fails
+        (say, because there's no active device), the error is printed, but
+        sorting carries on."""
+        if self.playback_start_position_ms is None:
+            return
+        future = self.playback_executor.submit(self._start_playback, track, next_track)
+        future.add_done_callback(self._report_playback_error)
+
+    def skip_queued_track(self, track):
+        """Called instead of `start_playback()` for a track that won't be
+        sorted, so that if it was queued, it doesn't stay in the playback queue."""
+        if self.playback_start_position_ms is None:
+            return
+        future = self.playback_executor.submit(self._skip_queued_track, track)
+        future.add_done_callback(self._report_playback_error)
+
+    def _skip_to_queued_track(self, track):
+        """Moves playback on to `track`, which is next in the queue, unless it's
+        already playing because the last track ended."""
+        playing = self.spotify.playback_currently_playing()
+        if playing is None or playing.item is None or playing.item.id != track.id:
+            self.spotify.playback_next()
+        self.queued_track_id = None
+
+    def _skip_queued_track(self, track):
+        if track.id == self.queued_track_id:
+            self._skip_to_queued_track(track)
+
+    def _start_playback(self, track, next_track):
+        if track.id == self.queued_track_id:
+            self._skip_to_queued_track(track)
+            self.spotify.playback_seek(self.playback_start_position_ms)
+        else:
+            self.spotify.playback_start_tracks([track.id], position_ms=self.playback_start_position_ms)
+        self.queued_track_id = None
+
+        if self.queue_next and next_track is not None:
+            self.spotify.playback_queue_add("spotify:track:" + next_track.id)
+            self.queued_track_id = next_track.id
+
+    @staticmethod
+    def _report_playback_error(future):
+        error = future.exception()
+        if error is not None:
+            print(f"\n\033[0;33m⚠ Couldn't start playback: {error}\033[0m")
 
     def remove_track(self, playlist, track):
         """Removes the track from the specified playlist."""
         self.spotify.playlist_remove(playlist.id, ["spotify:track:" + track.id])
+        if isinstance(playlist, cached.CachedPlaylist):
+            playlist.remove_track_id(track.id)
         print(f"\033[0;31m←\033[0m removed from {playlist.name}")
 
     # Helper methods
 
+    def cache_path(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
     def is_track_properly_sorted(self, track_id):
         """Returns True if the track looks already fully sorted, i.e., if it is
         in WCS all, and is in exactly one tempo list, and is in at least one
         genre list. This method relies fully on cached information; it does not
         hit the API."""
-        in_all = self.all_playlist.contains_track_id(track_id)
-        in_tempo = [pl.contains_track_id(track_id) for pl in self.tempo_playlists].count(True)
-        in_genre = [pl.contains_track_id(track_id) for pl in self.genre_playlists].count(True)
-        return in_all and in_tempo == 1 and in_genre >= 1
+        return self.filing_index.is_properly_filed(track_id)
 
     def check_then_add_to_playlist(self, playlist, track_id):
+        """Adds the track to the playlist, unless it's already there. Returns
+        True if the track was added."""
         if playlist.contains_track_id(track_id):
             print(f"\033[0;35m✓ already in {playlist.name}\033[0m")
+            return False
         else:
-            for i in range(10):
-                try:
-                    self.spotify.playlist_add(playlist.id, ["spotify:track:" + track_id])
-                except httpx.ConnectError as e:
-                    if e.errno == 101:
-                        print("\033[0;32m△ Network unreachable, retrying...")
-                        time.sleep(6)
-                        continue
-                    else:
-                        raise
-                break
-            else:
-                print(f"\033[1;31m× Gave up adding to {playlist.name}")
-                return
+            import httpx
+
+            try:
+                self.spotify.playlist_add(playlist.id, ["spotify:track:" + track_id])
+            except httpx.TransportError as e:
+                print(f"\033[1;31m× Gave up adding to {playlist.name}: {e}\033[0m")
+                return False
 
             print(f"\033[0;32m→ added to {playlist.name}\033[0m")
             playlist.add_track_id(track_id)
+            return True
 
     def _get_audio_features(self, track_id):
         if track_id not in self.audio_features_cache:
@@ -198,6 +305,29 @@ class PlaylistSorter:
                 genres = ", ".join(artist.genres)
                 print(f"genres of \033[0;36m{artist.name.rjust(max_name_length)}\033[0m: {genres}")
 
+        self.show_genre_hints(artists)
+
+    def show_genre_hints(self, artists):
+        """Shows the genre playlists that tracks by artists with these Spotify
+        genres are most often in."""
+        tags = {tag for artist in artists for tag in artist.genres}
+        hints = self.genre_hints.rank(tags)
+        if not hints:
+            return
+        formatted = []
+        for name, score in hints:
+            name = name[4:] if name.startswith("WCS ") else name
+            formatted.append(f"{name} \033[0;90m({score:.0%})\033[0;36m")
+        print("\033[0;36m▷ Artist genres suggest: " + ", ".join(formatted) + "\033[0m")
+
+    def record_genre_filing(self, track, playlist):
+        """Updates the genre hints with the fact that this track was just added to
+        this genre playlist."""
+        artists = self._get_artists([artist.id for artist in track.artists])
+        tags = {tag for artist in artists for tag in artist.genres}
+        new_track = len(self.genre_playlists.playlists_containing_track(track.id)) == 1
+        self.genre_hints.observe(tags, playlist.name, new_track=new_track)
+
     def show_audio_features(self, features):
         key_name = format_key(features.key, features.mode)
         print(f"\033[90mkey: {key_name}, time sig: {features.time_signature}, "
@@ -294,11 +424,28 @@ class PlaylistSorter:
                 user_error = True
 
         self.check_then_add_to_playlist(playlist, track.id)
-        update_cache('tempo.json', self.tempo_playlists)
+        update_cache(self.cache_path('tempo.json'), self.tempo_playlists)
+
+    def show_genre_suggestions(self, track):
+        if not self.genre_suggester:
+            return
+        features = self._get_audio_features(track.id)
+        if features is None:
+            return
+        suggestions = self.genre_suggester.suggest(features, exclude_track_id=track.id)
+        if not suggestions:
+            return
+        formatted = []
+        for playlist, score in suggestions:
+            name = playlist.name[4:] if playlist.name.startswith("WCS ") else playlist.name
+            formatted.append(f"{name} \033[0;90m({score:.0%})\033[0;36m")
+        print("\033[0;36m▷ Similar tracks are in: " + ", ".join(formatted) + "\033[0m")
 
     def add_to_genre_playlist(self, track):
         """The method name is a slight misnomer - it will actually accept any list."""
 
+        self.show_genre_suggestions(track)
+        hints_changed = False
         genre = input_with_skip(
             "Which genre list? " + "['?' to search in browser] " if self.browser else "")
 
@@ -317,11 +464,7 @@ class PlaylistSorter:
                     continue
 
             if genre == "pop":
-                release_year = int(track.album.release_date[:4])
-                if release_year < 1990:
-                    pop_playlist_name = "pre-1990s pop"
-                else:
-                    pop_playlist_name = f"{str(release_year // 10)}0s pop"
+                pop_playlist_name = decade_pop_playlist_name(track.album.release_date)
                 response = get_yes_no_input(f"\033[0;36m▷ Did you mean "
                                             f"\"WCS {pop_playlist_name}\"?\033[0m", default="yes")
                 if response:
@@ -341,11 +484,16 @@ class PlaylistSorter:
                     genre = input_with_skip(
                         f"\033[0;33m✘ Playlist \"WCS {genre}\" not found.\033[0m Try again? ")
                     continue
-                self.check_then_add_to_playlist(playlist, track.id)
+                added = self.check_then_add_to_playlist(playlist, track.id)
+                if added and self.genre_playlists.contains_playlist_id(playlist.id):
+                    self.record_genre_filing(track, playlist)
+                    hints_changed = True
 
             genre = input_with_skip("Any others? ")
 
-        update_cache('genre.json', self.genre_playlists)
+        update_cache(self.cache_path('genre.json'), self.genre_playlists)
+        if hints_changed:
+            self.genre_hints.save_to_filename(self.cache_path(HINTS_FILENAME))
 
     def add_to_wcs_all(self, track):
         response = (not self.prompt_for_all) or get_yes_no_input("Add to WCS all?")
@@ -367,14 +515,20 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('playlist',
         help="playlist to sort, specify by either name or ID")
-    parser.add_argument("--tekore-cfg", '-T', type=str, default='tekore.cfg',
-        help="file to use to store Tekore (Spotify) user token (default tekore.cfg)")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
     parser.add_argument("--playback-start", '-s', type=float, default=15,
         help="start playback this far through the song (default 15)")
     parser.add_argument("--browser", type=str, default="wslview",
         help="browser to open searches in (default wslview)")
     parser.add_argument("--remove-after-sort", action="store_true", default=False,
         help="remove the track from this playlist after it is sorted")
+    parser.add_argument("--queue-next", action="store_true", default=False,
+        help="also add the next track to the playback queue when starting playback")
+    parser.add_argument("--resume", action="store_true", default=False,
+        help="resume the last session on this playlist, from where it stopped "
+             "(saved in sort.<playlist ID>.session.json)")
+    add_profile_argument(parser)
 
     sort_prompting = parser.add_mutually_exclusive_group()
     sort_prompting.add_argument("--force-sort", '-f', action="store_const", const="always",
@@ -386,26 +540,59 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    import tekore
+
     scope = tekore.Scope(tekore.scope.user_modify_playback_state, tekore.scope.playlist_modify_public)
     if args.remove_after_sort:
         scope += tekore.scope.playlist_modify_private
 
-    sp = get_spotify_object(args.tekore_cfg, scope=scope)
-    playlist_id = parse_playlist_arg(args.playlist)
+    profile = get_profile(args.profile)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+    playlist_id = parse_playlist_arg(args.playlist, cache_dir=profile.cache_dir)
     playlist = sp.playlist(playlist_id)
     print(f"\033[1;34mSorting playlist: {playlist.name}\033[0;34m [{playlist.id}]\033[0m\n")
 
     sorter = PlaylistSorter(sp,
         playback_start_position_ms=args.playback_start * 1000,
         if_already_sorted=args.if_already_sorted,
-        browser=args.browser)
+        browser=args.browser,
+        queue_next=args.queue_next,
+        cache_dir=profile.cache_dir,
+        all_playlist_id=profile.all_playlist_id,
+        all_playlist_name=profile.all_playlist_name)
     sorter.all_cached_playlists.remove_playlist(playlist_id)
 
-    items = list(sp.all_items(playlist.tracks))
-    sorter.prefetch_tracks_info([item.track for item in items])
-
-    for item in items:
-        sorter.sort_item(item)
-        if args.remove_after_sort:
-            sorter.remove_track(playlist, item.track)
-        print()  # blank line
+    # The playlist is fetched and sorted a page at a time, so that only one
+    # page of tracks (and their features and artists) is held at once. Tracks
+    # removed after sorting were before the next page, so it moves back by one
+    # for each removed item.
+    source = {'script': 'sort', 'playlist_id': playlist_id}
+    session_filename = profile.path(SESSION_FILENAME.format(playlist_id=playlist_id))
+    session, resumed = start_or_resume(session_filename, source, args.resume, next_offset=0)
+    if resumed:
+        session.restore_prefetched(sorter)
+
+    while True:
+        for (track, added_at), (next_track, _) in with_next(session.remaining(), (None, None)):
+            decision = sorter.sort_track(track, added_at=added_at, next_track=next_track)
+            if args.remove_after_sort:
+                sorter.remove_track(playlist, track)
+                if session.next_offset is not None:  # removes every copy of the track
+                    session.next_offset -= sum(1 for entry in session.queue
+                                               if entry['track']['id'] == track.id)
+            session.store_prefetched(sorter)
+            session.record(track.id, decision)
+            print()  # blank line
+
+        if session.next_offset is None:
+            break
+
+        page = sp.playlist_items(playlist_id, limit=PAGE_SIZE, offset=session.next_offset)
+        items = [item for item in page.items if item.track is not None and item.track.id is not None]
+        session.next_offset = session.next_offset + len(page.items) if page.next else None
+        sorter.prefetch_tracks_info([item.track for item in items])
+        session.extend_queue([item.track for item in items], [item.added_at for item in items])
+        session.store_prefetched(sorter)
+        session.save()
+
+    session.finish()
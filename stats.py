@@ -0,0 +1,209 @@
+"""Prints statistics about the library: a tempo histogram, audio features and
+release years for each playlist, and how much playlists overlap. Works only from
+the cache (including tracks.json and features.json), so run update.py first.
+
+Can also export the underlying tables to CSV files or a NumPy .npz file."""
+
+import argparse
+import csv
+import os.path
+import warnings
+
+import numpy as np
+
+from cached import CachedPlaylistGroup
+from categories import CATEGORIES
+from features import AudioFeaturesCache, DEFAULT_FILENAME as FEATURES_FILENAME
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+
+TABLE_FEATURES = ['tempo', 'energy', 'danceability', 'acousticness', 'valence', 'loudness']
+
+
+def build_table(playlists, features_cache, track_info):
+    """Returns a tuple `(table, membership)`. `table` is a structured array with
+    a row for each track in any of the playlists, with fields for the track ID,
+    audio features (NaN if unknown) and release year (0 if unknown).
+    `membership[i, j]` is True if track i is in playlist j."""
+    track_ids = list(dict.fromkeys(track_id for playlist in playlists
+                                   for track_id in playlist.track_ids))
+    row_by_id = {track_id: i for i, track_id in enumerate(track_ids)}
+
+    dtype = [('id', 'U22')] + [(name, 'f8') for name in TABLE_FEATURES] + [('release_year', 'i4')]
+    table = np.zeros(len(track_ids), dtype=dtype)
+    table['id'] = track_ids
+
+    found_ids, matrix = features_cache.matrix(track_ids, TABLE_FEATURES)
+    found_rows = np.array([row_by_id[track_id] for track_id in found_ids], dtype=int)
+    for j, name in enumerate(TABLE_FEATURES):
+        column = np.full(len(track_ids), np.nan)
+        column[found_rows] = matrix[:, j]
+        table[name] = column
+
+    years = []
+    for track_id in track_ids:
+        info = track_info.get(track_id)
+        release_date = info and info['release_date']
+        years.append(int(release_date[:4]) if release_date else 0)
+    table['release_year'] = years
+
+    membership = np.zeros((len(track_ids), len(playlists)), dtype=bool)
+    for j, playlist in enumerate(playlists):
+        membership[[row_by_id[track_id] for track_id in playlist.track_ids], j] = True
+
+    return table, membership
+
+
+def tempo_histogram(table, bin_width=5):
+    tempos = table['tempo'][~np.isnan(table['tempo'])]
+    clipped = np.where(tempos < 60, tempos * 2, np.where(tempos > 140, tempos / 2, tempos))
+    bins = np.arange(60, 140 + bin_width, bin_width)
+    counts, edges = np.histogram(clipped, bins=bins)
+    return counts, edges
+
+
+def grouped_stats(table, membership, field):
+    """Returns a dict of arrays, each with an element for each playlist: the
+    count of tracks with a known value, and the mean, standard deviation,
+    minimum, quartiles and maximum of `field` over those tracks."""
+    values = table[field].astype(float)
+    if field == 'release_year':
+        values[values == 0] = np.nan
+    known = ~np.isnan(values)
+    masked = membership & known[:, np.newaxis]
+
+    counts = masked.sum(axis=0)
+    sums = np.where(known, values, 0) @ masked
+    squares = np.where(known, values ** 2, 0) @ masked
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means ** 2, 0))
+
+    # Quantiles need sorting, so do them by playlist, but on whole columns.
+    grid = np.where(masked, values[:, np.newaxis], np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # playlists with no known values
+        quantiles = np.nanquantile(grid, [0, 0.25, 0.5, 0.75, 1], axis=0)
+
+    return {'count': counts, 'mean': means, 'std': stds, 'min': quantiles[0], 'q1': quantiles[1],
+            'median': quantiles[2], 'q3': quantiles[3], 'max': quantiles[4]}
+
+
+def overlap_matrix(membership):
+    """`overlap[i, j]` is the number of tracks in both playlist i and playlist j."""
+    m = membership.astype(np.int32)
+    return m.T @ m
+
+
+def short_name(name):
+    return name[4:] if name.startswith("WCS ") else name
+
+
+def print_tempo_histogram(counts, edges):
+    print("\033[1;36mTempo (clipped to 60–140 bpm)\033[0m")
+    scale = max(1, counts.max() / 50) if len(counts) else 1
+    for count, lo, hi in zip(counts, edges[:-1], edges[1:]):
+        print(f"{lo:3.0f}–{hi:3.0f} │ {'█' * int(round(count / scale))} {count}")
+    print()
+
+
+def print_grouped_stats(names, stats, field, fmt="{:.2f}"):
+    print(f"\033[1;36m{field}\033[0m")
+    width = max(len(short_name(name)) for name in names)
+    print(f"{'':{width}s} │ {'n':>5s} │ " + " ".join(f"{h:>7s}" for h in
+          ['mean', 'std', 'min', 'q1', 'median', 'q3', 'max']))
+    for j, name in enumerate(names):
+        values = [stats[key][j] for key in ['mean', 'std', 'min', 'q1', 'median', 'q3', 'max']]
+        formatted = " ".join(f"{'-' if np.isnan(v) else fmt.format(v):>7s}" for v in values)
+        print(f"{short_name(name):{width}s} │ {stats['count'][j]:5d} │ {formatted}")
+    print()
+
+
+def print_overlap(names, overlap):
+    print("\033[1;36mOverlap (number of tracks in both)\033[0m")
+    width = max(len(short_name(name)) for name in names)
+    abbrevs = [short_name(name)[:5] for name in names]
+    print(f"{'':{width}s} │ " + " ".join(f"{a:>5s}" for a in abbrevs))
+    for i, name in enumerate(names):
+        print(f"{short_name(name):{width}s} │ " + " ".join(f"{n:5d}" for n in overlap[i]))
+    print()
+
+
+def export_csv(directory, names, table, membership, stats_by_field, overlap):
+    os.makedirs(directory, exist_ok=True)
+
+    fp = open(os.path.join(directory, 'tracks.csv'), 'w', newline='')
+    writer = csv.writer(fp)
+    writer.writerow(list(table.dtype.names) + names)
+    for row, member in zip(table.tolist(), membership.astype(int).tolist()):
+        writer.writerow(list(row) + member)
+    fp.close()
+
+    fp = open(os.path.join(directory, 'playlists.csv'), 'w', newline='')
+    writer = csv.writer(fp)
+    keys = ['count', 'mean', 'std', 'min', 'q1', 'median', 'q3', 'max']
+    writer.writerow(['playlist', 'field'] + keys)
+    for field, stats in stats_by_field.items():
+        for j, name in enumerate(names):
+            writer.writerow([name, field] + [stats[key][j] for key in keys])
+    fp.close()
+
+    fp = open(os.path.join(directory, 'overlap.csv'), 'w', newline='')
+    writer = csv.writer(fp)
+    writer.writerow([''] + names)
+    for name, row in zip(names, overlap.tolist()):
+        writer.writerow([name] + row)
+    fp.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--category", '-c', choices=[filename[:-5] for filename in CATEGORIES.keys()],
+        default='genre', help="playlists to show statistics for (default genre)")
+    parser.add_argument("--fields", nargs='+', default=['energy', 'danceability', 'release_year'],
+        choices=TABLE_FEATURES + ['release_year'],
+        help="fields to summarize for each playlist (default energy danceability release_year)")
+    parser.add_argument("--csv", type=str, default=None, metavar="DIR",
+        help="also write tables as CSV files in this directory")
+    parser.add_argument("--npz", type=str, default=None, metavar="FILE",
+        help="also save tables to this NumPy .npz file")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    all_playlists = list(CachedPlaylistGroup.from_filenames(profile.path(filename)
+                                                            for filename in CATEGORIES.keys()))
+    features_cache = AudioFeaturesCache.from_filename(profile.path(FEATURES_FILENAME))
+    track_info = TrackInfoCache.from_filename(profile.path(TRACKS_FILENAME))
+    table, all_membership = build_table(all_playlists, features_cache, track_info)
+
+    category_file = profile.path(args.category + '.json')
+    category_ids = {playlist.id for playlist in CachedPlaylistGroup.from_filename(category_file)}
+    columns = [j for j, playlist in enumerate(all_playlists) if playlist.id in category_ids]
+    names = [all_playlists[j].name for j in columns]
+    membership = all_membership[:, columns]
+
+    print(f"{len(table)} tracks, {np.count_nonzero(~np.isnan(table['tempo']))} with audio features, "
+          f"{np.count_nonzero(table['release_year'])} with release dates\n")
+
+    print_tempo_histogram(*tempo_histogram(table))
+
+    stats_by_field = {field: grouped_stats(table, membership, field) for field in args.fields}
+    for field, stats in stats_by_field.items():
+        fmt = "{:.0f}" if field in ['release_year', 'tempo'] else "{:.2f}"
+        print_grouped_stats(names, stats, field, fmt)
+
+    overlap = overlap_matrix(membership)
+    print_overlap(names, overlap)
+
+    if args.csv:
+        export_csv(args.csv, names, table, membership, stats_by_field, overlap)
+        print(f"Wrote CSV files to {args.csv}")
+
+    if args.npz:
+        np.savez_compressed(args.npz, table=table, membership=membership, playlists=np.array(names),
+                            overlap=overlap, **{f"stats_{field}_{key}": value
+                                                for field, stats in stats_by_field.items()
+                                                for key, value in stats.items()})
+        print(f"Saved tables to {args.npz}")
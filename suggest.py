@@ -0,0 +1,75 @@
+"""Suggests genre playlists for a track by a vote among the already-filed tracks
+whose audio features are most similar to it (k nearest neighbours)."""
+
+import numpy as np
+
+from features import FEATURE_NAMES
+
+# Features that say something about genre. Loudness, tempo and duration are on
+# other scales, but that's fine, since everything is standardized.
+SUGGESTION_FEATURES = [
+    'acousticness',
+    'danceability',
+    'energy',
+    'instrumentalness',
+    'loudness',
+    'speechiness',
+    'valence',
+    'tempo',
+]
+
+
+class GenreSuggester:
+    """Holds the standardized feature matrix of all filed tracks, with the
+    squared norm of each row precomputed, so that finding the nearest
+    neighbours of a track is one matrix-vector product."""
+
+    def __init__(self, features_cache, genre_playlists, k=15, names=SUGGESTION_FEATURES):
+        self.k = k
+        self.names = names
+        self.columns = [FEATURE_NAMES.index(name) for name in names]
+        self.playlists = list(genre_playlists)
+
+        filed_ids = list(dict.fromkeys(track_id for playlist in self.playlists
+                                       for track_id in playlist.track_ids))
+        self.track_ids, matrix = features_cache.matrix(filed_ids, names)
+
+        self.mean = matrix.mean(axis=0) if len(matrix) else np.zeros(len(names))
+        self.std = matrix.std(axis=0) if len(matrix) else np.ones(len(names))
+        self.std[self.std == 0] = 1
+        self.matrix = (matrix - self.mean) / self.std
+        self.sqnorms = (self.matrix ** 2).sum(axis=1)
+
+        # labels[i, j] is True if track i is in playlist j
+        self.row_by_id = {track_id: i for i, track_id in enumerate(self.track_ids)}
+        self.labels = np.zeros((len(self.track_ids), len(self.playlists)), dtype=bool)
+        for j, playlist in enumerate(self.playlists):
+            rows = [self.row_by_id[track_id] for track_id in playlist.track_ids
+                    if track_id in self.row_by_id]
+            self.labels[rows, j] = True
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def suggest(self, features, n=3, exclude_track_id=None):
+        """Returns up to `n` (playlist, score) pairs for a tekore `AudioFeatures`
+        object, best first. Scores are the fraction of the (distance-weighted)
+        vote each playlist got."""
+        if len(self.track_ids) == 0:
+            return []
+
+        x = (np.array([float(getattr(features, name)) for name in self.names]) - self.mean) / self.std
+        distances = self.sqnorms - 2 * (self.matrix @ x) + (x @ x)
+        if exclude_track_id in self.row_by_id:
+            distances[self.row_by_id[exclude_track_id]] = np.inf
+
+        k = min(self.k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        weights = 1 / (1 + np.sqrt(np.maximum(distances[nearest], 0)))
+        votes = weights @ self.labels[nearest]
+        if votes.sum() == 0:
+            return []
+        votes = votes / weights.sum()
+
+        best = np.argsort(votes)[::-1][:n]
+        return [(self.playlists[j], float(votes[j])) for j in best if votes[j] > 0]
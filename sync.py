@@ -0,0 +1,205 @@
+"""Makes playlists contain exactly the tracks they should, according to a rule,
+by adding and removing only what's different. Rules:
+  all   "WCS all" should contain every track in a tempo playlist (tracks not
+        in any tempo playlist yet are left in it, since they're still to be
+        filed, so this only adds)
+  pop   each track in a pop playlist should be in the pop playlist for the
+        decade it was released in (and no other pop playlist)
+  status
+        each date-based status playlist (see STATUS_RULES in categories.py)
+        should contain the tracks in "WCS all" added or released in its window
+        (run update.py first, since this uses dates it caches)
+
+Runs a dry run (i.e. does not change anything) by default. Use --confirm-sync to
+actually change the playlists."""
+
+import argparse
+import os.path
+
+from cached import CachedPlaylist, CachedPlaylistGroup
+from categories import STATUS_RULES
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+from utils import batches, decade_pop_playlist_name, format_artists, is_decade_pop_playlist_name
+
+
+def compute_playlist_diff(cached_playlist, target_track_ids):
+    """Returns a tuple `(to_add, to_remove)` of lists of track IDs, the minimal
+    changes needed to make `cached_playlist` contain exactly the tracks in
+    `target_track_ids`. `to_add` is in the order of `target_track_ids`."""
+    current = set(cached_playlist.track_ids)
+    target = dict.fromkeys(target_track_ids)  # ordered set
+    to_add = [track_id for track_id in target if track_id not in current]
+    to_remove = [track_id for track_id in dict.fromkeys(cached_playlist.track_ids)
+                 if track_id not in target]
+    return to_add, to_remove
+
+
+def print_track_changes(spotify, track_ids, action):
+    with spotify.chunked(True):
+        tracks = spotify.tracks(track_ids)
+    for track in tracks:
+        print(f"   {action} [{track.id}] \"{track.name}\" ({format_artists(track.artists)})")
+
+
+def sync_playlist(spotify, cached_playlist, target_track_ids, confirm=False, add_only=False):
+    """Makes the playlist contain exactly the tracks in `target_track_ids`,
+    in batches of up to 100 tracks per request, then updates `cached_playlist`
+    to match. If the playlist has changed since it was cached, it's refreshed
+    first, so that the changes are computed against what's actually there.
+    If `add_only` is True, tracks not in `target_track_ids` are left in it.
+
+    If `confirm` is False, just prints what would change. Returns a tuple
+    `(to_add, to_remove)`, as for `compute_playlist_diff()`."""
+
+    playlist = spotify.playlist(cached_playlist.id)
+    if playlist.snapshot_id != cached_playlist.snapshot_id:
+        cached_playlist.update_from_tekore_playlist(playlist, spotify)
+
+    to_add, to_remove = compute_playlist_diff(cached_playlist, target_track_ids)
+    if add_only:
+        to_remove = []
+    if not to_add and not to_remove:
+        print(f"{cached_playlist.name}: \033[0;90mup to date\033[0m")
+        return to_add, to_remove
+
+    print(f"{cached_playlist.name}: \033[0;32m+{len(to_add)}\033[0m \033[0;31m-{len(to_remove)}\033[0m")
+    if not confirm:
+        print_track_changes(spotify, to_add, "\033[0;32mWould add\033[0m")
+        print_track_changes(spotify, to_remove, "\033[0;31mWould remove\033[0m")
+        return to_add, to_remove
+
+    # Removals are pinned to the snapshot the diff was computed against.
+    snapshot_id = cached_playlist.snapshot_id
+    for batch in batches(to_remove):
+        snapshot_id = spotify.playlist_remove(cached_playlist.id,
+                ["spotify:track:" + track_id for track_id in batch], snapshot_id=snapshot_id)
+    for batch in batches(to_add):
+        snapshot_id = spotify.playlist_add(cached_playlist.id,
+                ["spotify:track:" + track_id for track_id in batch])
+
+    for track_id in to_remove:
+        cached_playlist.remove_track_id(track_id)
+    for track_id in to_add:
+        cached_playlist.add_track_id(track_id)
+    cached_playlist.snapshot_id = snapshot_id
+
+    return to_add, to_remove
+
+
+def fetch_all_playlist(spotify, all_playlist_id=None, all_playlist_name=None):
+    """Returns the all playlist as a `CachedPlaylist`. If `all_playlist_id` is
+    None, the one in settings.py is used."""
+    if all_playlist_id is None:
+        from settings import ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME
+        all_playlist_id, all_playlist_name = ALL_PLAYLIST_ID, ALL_PLAYLIST_NAME
+    return CachedPlaylist.from_playlist_id(all_playlist_id, spotify, expected_name=all_playlist_name)
+
+
+def sync_all_playlist(spotify, confirm=False, cache_dir='.', all_playlist_id=None,
+                      all_playlist_name=None):
+    tempo_playlists = CachedPlaylistGroup.from_filename(os.path.join(cache_dir, 'tempo.json'))
+    all_playlist = fetch_all_playlist(spotify, all_playlist_id, all_playlist_name)
+    target = [track_id for playlist in tempo_playlists for track_id in playlist.track_ids]
+    # Tracks not in a tempo playlist yet stay, since they're still to be filed
+    # (e.g. by autotempo.py), and removing them would lose their dates added.
+    sync_playlist(spotify, all_playlist, target, confirm, add_only=True)
+
+
+def sync_pop_playlists(spotify, confirm=False, cache_dir='.', **kwargs):
+    filename = os.path.join(cache_dir, 'genre.json')
+    genre_playlists = CachedPlaylistGroup.from_filename(filename)
+    pop_playlists = [playlist for playlist in genre_playlists
+                     if is_decade_pop_playlist_name(playlist.name)]
+
+    pop_track_ids = list(dict.fromkeys(track_id for playlist in pop_playlists
+                                       for track_id in playlist.track_ids))
+    with spotify.chunked(True):
+        tracks = spotify.tracks(pop_track_ids)
+
+    targets = {playlist.name: [] for playlist in pop_playlists}
+    for track in tracks:
+        name = None
+        if track.album.release_date is not None:
+            name = "WCS " + decade_pop_playlist_name(track.album.release_date)
+            if name not in targets:
+                print(f"\033[0;33mWarning: no playlist called '{name}' for \"{track.name}\"\033[0m")
+                name = None
+
+        if name is None:
+            # Can't tell where it should go, so leave it wherever it is now
+            for playlist in pop_playlists:
+                if playlist.contains_track_id(track.id):
+                    targets[playlist.name].append(track.id)
+            continue
+
+        targets[name].append(track.id)
+
+    for playlist in pop_playlists:
+        sync_playlist(spotify, playlist, targets[playlist.name], confirm)
+
+    if confirm:
+        genre_playlists.merge_and_save(filename)
+
+
+def sync_status_playlists(spotify, confirm=False, cache_dir='.', all_playlist_id=None,
+                          all_playlist_name=None):
+    filename = os.path.join(cache_dir, 'status.json')
+    status_playlists = CachedPlaylistGroup.from_filename(filename)
+    all_playlist = fetch_all_playlist(spotify, all_playlist_id, all_playlist_name)
+    in_library = set(all_playlist.track_ids)
+    track_info = TrackInfoCache.from_filename(os.path.join(cache_dir, TRACKS_FILENAME))
+
+    for name, (field, start, end) in STATUS_RULES.items():
+        playlist = status_playlists.playlist_by_name(name)
+        if playlist is None:
+            print(f"\033[0;33mWarning: no playlist called '{name}' in the cache\033[0m")
+            continue
+
+        if field == 'added':
+            track_ids = track_info.added_between(start, end)
+        elif field == 'released':
+            track_ids = track_info.released_between(start, end)
+        else:
+            raise ValueError(f"Invalid field in status rule for {name}: {field}")
+
+        target = [track_id for track_id in track_ids if track_id in in_library]
+        sync_playlist(spotify, playlist, target, confirm)
+
+    if confirm:
+        status_playlists.merge_and_save(filename)
+
+
+RULES = {
+    'all': sync_all_playlist,
+    'pop': sync_pop_playlists,
+    'status': sync_status_playlists,
+}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, allow_abbrev=False,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('rules', nargs='+', choices=RULES.keys(),
+        help="which playlists to sync")
+    parser.add_argument('--confirm-sync', action='store_true', default=False,
+        help="actually change the playlists")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    import tekore
+
+    scope = tekore.Scope(tekore.scope.playlist_read_private, tekore.scope.playlist_modify_public)
+    profile = get_profile(args.profile)
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+
+    for rule in args.rules:
+        RULES[rule](sp, confirm=args.confirm_sync, cache_dir=profile.cache_dir,
+                    all_playlist_id=profile.all_playlist_id,
+                    all_playlist_name=profile.all_playlist_name)
+
+    if not args.confirm_sync:
+        print("Use --confirm-sync to follow through with these changes.")
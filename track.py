@@ -1,86 +1,208 @@
 """Shows details for a given track (or the currently playing track).
+
+With --batch, reads many tracks (URIs, links or search terms, one per line) and
+writes information about each as JSON Lines, looking them up in as few requests
+as possible.
 """
 
 import argparse
+import json
+import sys
 
-import tekore
-
+import daemon_client
+from cached import all_cached_playlists
+from profiles import add_profile_argument, get_profile
 from sort import PlaylistSorter
-from utils import format_artists, get_spotify_object, parse_potential_uri, WrongUriType
-
-
-parser = argparse.ArgumentParser(description=__doc__)
-parser.add_argument("track", nargs='?',
-    help="track, specified by URI or search terms (gets currently playing track if omitted)")
-parser.add_argument("--tekore-cfg", '-T', type=str, default='tekore.cfg',
-    help="file to use to store Tekore (Spotify) user token (default tekore.cfg)")
-parser.add_argument("--browser", type=str, default="wslview",
-    help="browser to open searches in (default wslview)")
-parser.add_argument("--no-features", "-F", action="store_false", default=True, dest="more_features",
-    help="don't show more of Spotify's audio features")
-parser.add_argument("--sort", action="store_true", default=False,
-    help="sort the track")
-parser.add_argument("--markets", nargs='+', default=['NZ', 'US', 'AU', 'FR'],
-    help="markets of interest (default NZ US AU FR), "
-         "or 'all' to list all markets (normally a bad idea)")
-parser.add_argument("--verbose", "-v", action="store_true", default=False,
-    help="show more information about the search")
-args = parser.parse_args()
-
-scope = tekore.Scope()
-if args.sort:
-    scope += tekore.scope.user_modify_playback_state + tekore.scope.playlist_modify_public
-if not args.track:
-    scope += tekore.scope.user_read_currently_playing + tekore.scope.user_read_playback_state
-sp = get_spotify_object(args.tekore_cfg, scope=scope)
-
-sorter = PlaylistSorter(sp,
-    prompt_for_all=True,
-    browser=args.browser,
-    playback_start_position_ms=None,
-    more_features=args.more_features,
-    markets=None if 'all' in args.markets else args.markets)
-
-if args.track:
-
-    try:
-        track_id = parse_potential_uri(args.track, uritype="track")
-    except WrongUriType as e:
-        print("\033[0;33m" + str(e) + "\033[0m")
-        exit(1)
-
-    if track_id is None:
-        tracks, = sp.search(args.track)
-        for t in tracks.items:
-            if args.verbose:
-                print(f"Search result: {t.id} {t.name} "
-                      f"🎤 {format_artists(t.artists)} 💿 {t.album.name}")
-            if len(sorter.all_cached_playlists.playlists_containing_track(t.id)) > 0:
-                track = t
-                print("\033[1;33mFirst search result in existing playlists:\033[0m")
-                break
+from utils import clip_tempo, format_artists, parse_potential_uri, WrongUriType
+
+
+def find_track(sp, sorter, track_arg, verbose=False):
+    """Returns the track specified by `track_arg`, which can be a URI or search
+    terms, or the currently playing track if `track_arg` is None. Exits if
+    there's no such track."""
+    from tekore.model import FullTrack
+
+    if track_arg:
+
+        try:
+            track_id = parse_potential_uri(track_arg, uritype="track")
+        except WrongUriType as e:
+            print("\033[0;33m" + str(e) + "\033[0m")
+            exit(1)
+
+        if track_id is None:
+            tracks, = sp.search(track_arg)
+            for t in tracks.items:
+                if verbose:
+                    print(f"Search result: {t.id} {t.name} "
+                          f"🎤 {format_artists(t.artists)} 💿 {t.album.name}")
+                if len(sorter.all_cached_playlists.playlists_containing_track(t.id)) > 0:
+                    track = t
+                    print("\033[1;33mFirst search result in existing playlists:\033[0m")
+                    break
+            else:
+                track = tracks.items[0]
+                print("\033[1;33mFirst search result:\033[0m")
         else:
-            track = tracks.items[0]
-            print("\033[1;33mFirst search result:\033[0m")
-    else:
-        track = sp.track(track_id)
-
-else:
-    playing = sp.playback_currently_playing()
-    if playing is None:
-        print("\033[0;33mNothing is currently playing.\033[0m")
-        print("Specify a search term or track URI to see info about a specific track.")
-        exit(1)
-    elif not isinstance(playing.item, tekore.model.FullTrack):
-        print("\033[0;33mCurrently playing item isn't a (non-local) track.\033[0m")
-        exit(1)
+            track = sp.track(track_id)
+
     else:
-        track = playing.item
-        print("\033[1;32mCurrently playing:\033[0m")
+        playing = sp.playback_currently_playing()
+        if playing is None:
+            print("\033[0;33mNothing is currently playing.\033[0m")
+            print("Specify a search term or track URI to see info about a specific track.")
+            exit(1)
+        elif not isinstance(playing.item, FullTrack):
+            print("\033[0;33mCurrently playing item isn't a (non-local) track.\033[0m")
+            exit(1)
+        else:
+            track = playing.item
+            print("\033[1;32mCurrently playing:\033[0m")
+
+    return track
 
 
-if args.sort:
-    sorter.sort_track(track)
-else:
+def show_track(sp, sorter, track_arg, verbose=False):
+    track = find_track(sp, sorter, track_arg, verbose)
     sorter.show_track_info(track)
     sorter.show_existing_playlists(track)
+
+
+def resolve_track_ids(sp, lines, is_cached):
+    """Returns a list with the track ID for each line, or an error message
+    string (starting with "error: ") if it couldn't be found. IDs, URIs and
+    links are parsed locally; anything else needs a search request.
+    `is_cached(track_id)` says whether a track is in any cached playlist, to
+    prefer those among search results."""
+    results = []
+    for line in lines:
+        try:
+            track_id = parse_potential_uri(line, uritype="track")
+        except WrongUriType as e:
+            results.append("error: " + str(e))
+            continue
+
+        if track_id is None:
+            tracks, = sp.search(line, limit=10)
+            if not tracks.items:
+                results.append("error: no search results")
+                continue
+            in_cache = [t for t in tracks.items if is_cached(t.id)]
+            track_id = (in_cache or tracks.items)[0].id
+
+        results.append(track_id)
+    return results
+
+
+def batch_track_info(sp, lines, cache_dir='.'):
+    """Yields a dict of information about the track on each line, in order."""
+    playlists_by_track_id = {}
+    for playlist in all_cached_playlists(cache_dir):
+        for track_id in playlist.track_ids:
+            playlists_by_track_id.setdefault(track_id, []).append(playlist.name)
+
+    ids_or_errors = resolve_track_ids(sp, lines, lambda tid: tid in playlists_by_track_id)
+    track_ids = list(dict.fromkeys(x for x in ids_or_errors if not x.startswith("error: ")))
+
+    with sp.chunked(True):
+        tracks = {track.id: track for track in sp.tracks(track_ids) if track is not None}
+        features = {f.id: f for f in sp.tracks_audio_features(list(tracks.keys())) if f is not None}
+        artist_ids = list(dict.fromkeys(artist.id for track in tracks.values()
+                                        for artist in track.artists if artist.id))
+        artists = {artist.id: artist for artist in sp.artists(artist_ids)}
+
+    for line, track_id in zip(lines, ids_or_errors):
+        if track_id.startswith("error: "):
+            yield {'input': line, 'error': track_id[7:]}
+            continue
+        track = tracks.get(track_id)
+        if track is None:
+            yield {'input': line, 'error': "track not found"}
+            continue
+
+        info = {
+            'input': line,
+            'id': track.id,
+            'name': track.name,
+            'artists': [artist.name for artist in track.artists],
+            'album': track.album.name,
+            'release_date': track.album.release_date,
+            'popularity': track.popularity,
+            'tempo': None,
+            'nearest_tempo_list': None,
+            'artist_genres': {artist.name: artists[artist.id].genres
+                              for artist in track.artists if artist.id in artists},
+            'playlists': playlists_by_track_id.get(track.id, []),
+        }
+        if track.id in features:
+            info['tempo'] = features[track.id].tempo
+            info['nearest_tempo_list'] = int(round(clip_tempo(features[track.id].tempo), ndigits=-1))
+        yield info
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("track", nargs='?',
+        help="track, specified by URI or search terms (gets currently playing track if omitted)")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    parser.add_argument("--browser", type=str, default="wslview",
+        help="browser to open searches in (default wslview)")
+    parser.add_argument("--no-features", "-F", action="store_false", default=True, dest="more_features",
+        help="don't show more of Spotify's audio features")
+    parser.add_argument("--sort", action="store_true", default=False,
+        help="sort the track")
+    parser.add_argument("--markets", nargs='+', default=['NZ', 'US', 'AU', 'FR'],
+        help="markets of interest (default NZ US AU FR), "
+             "or 'all' to list all markets (normally a bad idea)")
+    parser.add_argument("--verbose", "-v", action="store_true", default=False,
+        help="show more information about the search")
+    parser.add_argument("--batch", type=argparse.FileType('r'), default=None, metavar="FILE",
+        help="read tracks from this file ('-' for stdin), one per line, and write JSON Lines")
+    add_profile_argument(parser)
+    daemon_client.add_daemon_arguments(parser)
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+
+    if args.batch:
+        lines = [line.strip() for line in args.batch if line.strip()]
+        sp = profile.get_spotify_object(args.tekore_cfg)
+        for info in batch_track_info(sp, lines, profile.cache_dir):
+            sys.stdout.write(json.dumps(info, ensure_ascii=False) + "\n")
+        exit(0)
+
+    markets = None if 'all' in args.markets else args.markets
+
+    if not args.sort and args.use_daemon:
+        status = daemon_client.query(args.socket, 'track', profile.name, track=args.track,
+                                     verbose=args.verbose, more_features=args.more_features,
+                                     markets=markets)
+        if status is not None:
+            exit(status)
+
+    import tekore
+
+    scope = tekore.Scope()
+    if args.sort:
+        scope += tekore.scope.user_modify_playback_state + tekore.scope.playlist_modify_public
+    if not args.track:
+        scope += tekore.scope.user_read_currently_playing + tekore.scope.user_read_playback_state
+    sp = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+
+    sorter = PlaylistSorter(sp,
+        prompt_for_all=True,
+        browser=args.browser,
+        playback_start_position_ms=None,
+        more_features=args.more_features,
+        markets=markets,
+        cache_dir=profile.cache_dir,
+        all_playlist_id=profile.all_playlist_id,
+        all_playlist_name=profile.all_playlist_name)
+
+    if args.sort:
+        track = find_track(sp, sorter, args.track, args.verbose)
+        sorter.sort_track(track)
+    else:
+        show_track(sp, sorter, args.track, args.verbose)
@@ -0,0 +1,134 @@
+"""Cache of information about tracks in the library, other than which playlists
+they're in. update.py collects this while it's downloading playlists anyway. It
+also downloads the all playlist, since that's where dates added come from.
+
+Alongside the information for each track, the cache keeps indexes of tracks
+sorted by date added and release date, so that finding tracks in a date range
+is a binary search."""
+
+import bisect
+import json
+import os.path
+from typing import Dict, List
+
+DEFAULT_FILENAME = 'tracks.json'
+
+
+class TrackInfoCache:
+
+    tracks: Dict[str, dict]
+    added_index: List[List[str]]     # sorted [added_at, track_id] pairs
+    release_index: List[List[str]]   # sorted [release_date, track_id] pairs
+
+    def __init__(self):
+        self.tracks = {}
+        self.added_index = []
+        self.release_index = []
+        self.library_snapshot_id = None  # of the all playlist when its dates added were recorded
+        self._indexes_stale = False
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __contains__(self, track_id):
+        return track_id in self.tracks
+
+    def get(self, track_id):
+        return self.tracks.get(track_id)
+
+    def record_item(self, item):
+        """Records information from a tekore playlist item. The date added is
+        left as it was; it's set by `record_library()`."""
+        track = item.track
+        if track is None or track.id is None:
+            return
+
+        existing = self.tracks.get(track.id)
+        added_at = existing['added_at'] if existing else None
+
+        external_ids = getattr(track, 'external_ids', None) or {}
+        self.tracks[track.id] = {
+            'name': track.name,
+            'artists': [[artist.id, artist.name] for artist in track.artists],
+            'release_date': track.album.release_date,
+            'isrc': external_ids.get('isrc'),
+            'added_at': added_at,
+        }
+        self._indexes_stale = True
+
+    def record_library(self, items, snapshot_id=None):
+        """Records the items in the all playlist, at snapshot `snapshot_id`.
+        Dates added come only from these, since a track's date added is when it
+        joined the library, not when it was filed; tracks that aren't in the
+        library have none. If a track is in it more than once, the earliest
+        date is kept."""
+        added = {}
+        for item in items:
+            track = item.track
+            if track is None or track.id is None:
+                continue
+            self.record_item(item)
+            added_at = item.added_at.strftime("%Y-%m-%dT%H:%M:%SZ") if item.added_at else None
+            earliest = added.get(track.id)
+            if track.id not in added or (added_at and (earliest is None or added_at < earliest)):
+                added[track.id] = added_at
+
+        for track_id, info in self.tracks.items():
+            info['added_at'] = added.get(track_id)
+        self.library_snapshot_id = snapshot_id
+        self._indexes_stale = True
+
+    def rebuild_indexes(self):
+        self.added_index = sorted([info['added_at'], track_id]
+                for track_id, info in self.tracks.items() if info['added_at'])
+        self.release_index = sorted([info['release_date'], track_id]
+                for track_id, info in self.tracks.items() if info['release_date'])
+        self._indexes_stale = False
+
+    @staticmethod
+    def _range(index, start=None, end=None):
+        """Returns track IDs in `index` with dates on or after `start` and before
+        `end` (either can be None for no limit), in date order. Dates are
+        compared as strings, so "2020" is before "2020-01-01"."""
+        lo = bisect.bisect_left(index, [start]) if start else 0
+        hi = bisect.bisect_left(index, [end]) if end else len(index)
+        return [track_id for date, track_id in index[lo:hi]]
+
+    def added_between(self, start=None, end=None):
+        if self._indexes_stale:
+            self.rebuild_indexes()
+        return self._range(self.added_index, start, end)
+
+    def released_between(self, start=None, end=None):
+        if self._indexes_stale:
+            self.rebuild_indexes()
+        return self._range(self.release_index, start, end)
+
+    def save_to_filename(self, filename=DEFAULT_FILENAME):
+        if self._indexes_stale:
+            self.rebuild_indexes()
+        data = {
+            'tracks': self.tracks,
+            'added_index': self.added_index,
+            'release_index': self.release_index,
+            'library_snapshot_id': self.library_snapshot_id,
+        }
+        fp = open(filename, 'w')
+        json.dump(data, fp)
+        fp.close()
+
+    @classmethod
+    def from_filename(cls, filename=DEFAULT_FILENAME):
+        """Returns the cache in `filename`, or an empty cache if there isn't
+        one yet."""
+        obj = cls()
+        if not os.path.exists(filename):
+            return obj
+        fp = open(filename)
+        data = json.load(fp)
+        fp.close()
+        obj.tracks = data['tracks']
+        obj.added_index = data['added_index']
+        obj.release_index = data['release_index']
+        obj.library_snapshot_id = data.get('library_snapshot_id')
+        return obj
@@ -1,29 +1,53 @@
-"""Updates the category playlist cache."""
+"""Updates the category playlist cache. With --watch, keeps watching for changes
+to the playlists and updates the cache when they happen. Changes are also
+recorded in the playlist history (see history.py)."""
 
 import argparse
-import json
+import os
+import time
 
-import tekore
-
-from cached import CachedPlaylist, CachedPlaylistGroup
+from cached import CachedPlaylist, CachedPlaylistGroup, locked_cache_file, write_json_atomically
 from categories import CATEGORIES
-from utils import get_spotify_object
+from features import AudioFeaturesCache, DEFAULT_FILENAME as FEATURES_FILENAME
+from history import DEFAULT_FILENAME as HISTORY_FILENAME, PlaylistHistory
+from profiles import add_profile_argument, get_profile
+from trackinfo import DEFAULT_FILENAME as TRACKS_FILENAME, TrackInfoCache
+
+
+def default_all_playlist_id():
+    from settings import ALL_PLAYLIST_ID
+    return ALL_PLAYLIST_ID
+
 
+def update_library_track_info(spotify, track_info, all_playlist_id):
+    """Records dates added in `track_info` from the all playlist."""
+    playlist = spotify.playlist(all_playlist_id)
+    print(f"Updating dates added from [{playlist.id}] {playlist.name}...")
+    track_info.record_library(spotify.all_items(playlist.tracks), playlist.snapshot_id)
 
-def update_cached_playlists(spotify):
+
+def update_cached_playlists(spotify, create_missing=False, cache_dir='.', all_playlist_id=None):
+    """Fetches all the category playlists, and replaces the cache files in
+    `cache_dir` with them. Dates added are taken from the all playlist,
+    `all_playlist_id` (default ALL_PLAYLIST_ID in settings.py)."""
+    os.makedirs(cache_dir, exist_ok=True)
     user = spotify.current_user()
     playlist_items = spotify.all_items(spotify.followed_playlists())
     playlists_by_name = {item.name: item for item in playlist_items if item.owner.id == user.id}
+    track_info_filename = os.path.join(cache_dir, TRACKS_FILENAME)
+    track_info = TrackInfoCache.from_filename(track_info_filename)
+    history = PlaylistHistory.from_filename(os.path.join(cache_dir, HISTORY_FILENAME))
     missing_found = 0
 
     for name, playlist_names in CATEGORIES.items():
+        filename = os.path.join(cache_dir, name)
         group = CachedPlaylistGroup()
 
         for playlist_name in playlist_names:
             try:
                 playlist = playlists_by_name[playlist_name]
             except KeyError:
-                if args.create_missing:
+                if create_missing:
                     playlist = spotify.playlist_create(
                         user.id, playlist_name,
                         description="Automatically created by a script.")
@@ -35,12 +59,16 @@ def update_cached_playlists(spotify):
 
             print(f"Updating cache for [{playlist.id}] {playlist.name}...")
 
-            obj = CachedPlaylist.from_tekore_playlist(playlist, spotify)
+            obj = CachedPlaylist.from_tekore_playlist(playlist, spotify, track_info)
             group.add_playlist(obj)
+            history.record(obj)
+
+        group.save_to_filename(filename)
+        history.save()
 
-        fp = open(name, 'w')
-        json.dump(group.serialize(), fp, indent=2)
-        fp.close()
+    update_library_track_info(spotify, track_info, all_playlist_id or default_all_playlist_id())
+    track_info.save_to_filename(track_info_filename)
+    update_features_cache(spotify, track_info.tracks.keys(), cache_dir)
 
     if missing_found:
         if missing_found == 1:
@@ -51,16 +79,137 @@ def update_cached_playlists(spotify):
                   "Rerun this script with --create-missing to create them.\033[0m")
 
 
+def update_features_cache(spotify, track_ids, cache_dir='.'):
+    """Fetches audio features for any of `track_ids` that don't have them
+    cached yet."""
+    import tekore
+
+    filename = os.path.join(cache_dir, FEATURES_FILENAME)
+    features_cache = AudioFeaturesCache.from_filename(filename)
+    try:
+        nfetched = features_cache.fetch_missing(spotify, track_ids)
+    except tekore.HTTPError as e:
+        print(f"\033[0;33mWarning: couldn't fetch audio features: {e}\033[0m")
+        return
+    if nfetched:
+        print(f"Fetched audio features for {nfetched} tracks.")
+        features_cache.save_to_filename(filename)
+
+
+def update_changed_playlists(spotify, cache_dir='.', all_playlist_id=None):
+    """Checks the snapshot IDs of all cached playlists, and updates only the ones
+    that have changed, in place. Dates added are updated too if the all playlist
+    has changed. Returns the number of playlists updated.
+
+    Only the playlists that changed are replaced in the cache files, which are
+    reloaded under their locks to do so, so that changes that other processes
+    (e.g. sort.py) have saved meanwhile aren't lost."""
+    user = spotify.current_user()
+    playlist_items = spotify.all_items(spotify.followed_playlists())
+    playlists_by_id = {item.id: item for item in playlist_items if item.owner.id == user.id}
+    track_info_filename = os.path.join(cache_dir, TRACKS_FILENAME)
+    track_info = TrackInfoCache.from_filename(track_info_filename)
+    history = PlaylistHistory.from_filename(os.path.join(cache_dir, HISTORY_FILENAME))
+    nchanged = 0
+
+    for name in CATEGORIES.keys():
+        filename = os.path.join(cache_dir, name)
+        updated = {}
+
+        for cached in CachedPlaylistGroup.from_filename(filename):
+            try:
+                playlist = playlists_by_id[cached.id]
+            except KeyError:
+                print(f"\033[0;33mWarning: playlist [{cached.id}] {cached.name} is gone, "
+                      "run update.py without --watch to fix\033[0m")
+                continue
+
+            if playlist.snapshot_id == cached.snapshot_id:
+                continue
+
+            added, removed = cached.update_from_tekore_playlist(playlist, spotify, track_info)
+            history.record(cached)
+            print(f"{time.strftime('%H:%M:%S')} [{cached.id}] {cached.name}: "
+                  f"\033[0;32m+{len(added)}\033[0m \033[0;31m-{len(removed)}\033[0m")
+            updated[cached.id] = cached
+            nchanged += 1
+
+        if not updated:
+            continue
+
+        with locked_cache_file(filename):
+            group = CachedPlaylistGroup.from_filename(filename)
+            group.playlists = [updated.get(playlist.id, playlist) for playlist in group]
+            write_json_atomically(filename, group.serialize(), indent=2)
+        history.save()
+
+    library = playlists_by_id.get(all_playlist_id or default_all_playlist_id())
+    if library is not None and library.snapshot_id != track_info.library_snapshot_id:
+        update_library_track_info(spotify, track_info, library.id)
+        nchanged += 1
+
+    if nchanged:
+        track_info.save_to_filename(track_info_filename)
+        update_features_cache(spotify, track_info.tracks.keys(), cache_dir)
+
+    return nchanged
+
+
+def watch_cached_playlists(spotify, min_interval=30, max_interval=600, cache_dir='.',
+                           all_playlist_id=None):
+    """Polls for changes forever. The polling interval starts at `min_interval`
+    seconds, doubles every time nothing has changed (or something went wrong),
+    up to `max_interval`, and goes back to `min_interval` when something does
+    change."""
+    import httpx
+    import tekore
+
+    interval = min_interval
+    print(f"\033[1;36mWatching for changes (every {min_interval}–{max_interval} seconds), "
+          "Ctrl+C to stop\033[0m")
+
+    while True:
+        try:
+            nchanged = update_changed_playlists(spotify, cache_dir, all_playlist_id)
+        except (httpx.TransportError, tekore.HTTPError) as e:
+            print(f"\033[0;33m{time.strftime('%H:%M:%S')} Couldn't check for changes: {e}\033[0m")
+            nchanged = 0
+
+        if nchanged:
+            interval = min_interval
+        time.sleep(interval)
+        if not nchanged:
+            interval = min(interval * 2, max_interval)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("--tekore-cfg", '-T', type=str, default='tekore.cfg',
-        help="file to use to store Tekore (Spotify) user token")
+    parser.add_argument("--tekore-cfg", '-T', type=str, default=None,
+        help="file to use to store Tekore (Spotify) user token (default tekore.cfg, or the profile's)")
+    add_profile_argument(parser)
     parser.add_argument("--create-missing", action="store_true", default=False,
         help="create playlists that don't already exist")
+    parser.add_argument("--watch", action="store_true", default=False,
+        help="keep watching for changes and update the cache as they happen")
+    parser.add_argument("--interval", type=float, default=30,
+        help="with --watch, shortest time between checks in seconds (default 30)")
+    parser.add_argument("--max-interval", type=float, default=600,
+        help="with --watch, longest time between checks in seconds (default 600)")
     args = parser.parse_args()
 
+    import tekore
+
     scope = tekore.scope.playlist_read_private
     if args.create_missing:
         scope += tekore.scope.playlist_modify_private
-    spotify = get_spotify_object(args.tekore_cfg, scope=scope)
-    update_cached_playlists(spotify)
+    profile = get_profile(args.profile)
+    spotify = profile.get_spotify_object(args.tekore_cfg, scope=scope)
+    if args.watch:
+        try:
+            watch_cached_playlists(spotify, args.interval, args.max_interval, profile.cache_dir,
+                                   profile.all_playlist_id)
+        except KeyboardInterrupt:
+            print("Okay, bye!")
+    else:
+        update_cached_playlists(spotify, create_missing=args.create_missing, cache_dir=profile.cache_dir,
+                                all_playlist_id=profile.all_playlist_id)
@@ -1,18 +1,13 @@
-import difflib
+"""Helper functions shared by the scripts. Modules that are slow to import
+(tekore, httpx and difflib) are imported only in the functions that need them,
+so that scripts start quickly when they don't, e.g. with --help."""
+
 import os.path
 import re
 
-import tekore
-
 from cached import CachedPlaylistGroup
 from categories import CATEGORIES
 
-try:
-    from settings import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI
-except ImportError:
-    print("Error: Before using this, copy settings.example to settings.py and fill in its blanks")
-    exit(1)
-
 
 KEY_NAMES = [
     ["C minor", "C♯ minor", "D minor", "E♭ minor", "E minor", "F minor",
@@ -27,12 +22,35 @@ class WrongUriType(Exception):
         super().__init__(f"Wrong URI type: {uritype} (expected: {expected})")
 
 
-def get_spotify_object(tekore_cfg_file, scope=None):
+def get_spotify_object(tekore_cfg_file, scope=None, asynchronous=False, credentials=None):
+    """Returns a `tekore.Spotify` object using the shared HTTP connection pool.
+    If `asynchronous` is True, its methods return coroutines. `credentials` is a
+    tuple `(client_id, client_secret, redirect_uri)`; if it's None, those in
+    settings.py are used."""
+    if credentials is None:
+        try:
+            from settings import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI
+        except ImportError:
+            print("Error: Before using this, copy settings.example to settings.py and fill in "
+                  "its blanks")
+            exit(1)
+        credentials = (CLIENT_ID, CLIENT_SECRET, REDIRECT_URI)
+    client_id, client_secret, redirect_uri = credentials
+
+    import tekore
+
+    from auth import CachedToken, token_filename, TokenRefreshingSender
+    from senders import get_sender
+
     token = None
+    credentials = tekore.Credentials(client_id, client_secret, redirect_uri, sender=get_sender())
+    token_file = token_filename(tekore_cfg_file)
 
     if os.path.exists(tekore_cfg_file):
         conf = tekore.config_from_file(tekore_cfg_file, return_refresh=True)
-        token = tekore.refresh_user_token(*conf[:2], conf[3])
+        token = CachedToken.from_file(token_file, credentials, conf[3])
+        if token is None:
+            token = CachedToken.from_refresh_token(token_file, credentials, conf[3])
 
         if not scope:
             scope = tekore.Scope()
@@ -45,15 +63,18 @@ def get_spotify_object(tekore_cfg_file, scope=None):
             token = None
 
     if token is None:
-        token = tekore.prompt_for_user_token(client_id=CLIENT_ID, client_secret=CLIENT_SECRET,
-                redirect_uri=REDIRECT_URI, scope=scope)
-        if not token:
+        new_token = tekore.prompt_for_user_token(client_id=client_id, client_secret=client_secret,
+                redirect_uri=redirect_uri, scope=scope)
+        if not new_token:
             print("Couldn't get Spotify API token")
             exit(1)
         tekore.config_to_file(tekore_cfg_file,
-                (CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, token.refresh_token))
+                (client_id, client_secret, redirect_uri, new_token.refresh_token))
+        token = CachedToken(new_token, credentials, token_file)
+        token.save()
 
-    return tekore.Spotify(token)
+    sender = TokenRefreshingSender(token, get_sender(asynchronous))
+    return tekore.Spotify(token, sender=sender)
 
 
 def format_release_date(release_date, precision='year'):
@@ -66,6 +87,22 @@ def format_release_date(release_date, precision='year'):
     return release_date[:length].ljust(length)
 
 
+def decade_pop_playlist_name(release_date):
+    """Returns the name (without "WCS ") of the pop playlist for a track with
+    this release date, e.g. "2010s pop" or "pre-1990 pop"."""
+    release_year = int(release_date[:4])
+    if release_year < 1990:
+        return "pre-1990 pop"
+    else:
+        return f"{str(release_year // 10)}0s pop"
+
+
+def is_decade_pop_playlist_name(name):
+    """Returns True if `name` is the name of a decade pop playlist, e.g.
+    "WCS 2010s pop" or "WCS pre-1990 pop"."""
+    return re.fullmatch(r"WCS (pre-\d{4}|\d{4}s) pop", name) is not None
+
+
 def clip_tempo(tempo):
     if tempo < 60:
         return tempo * 2
@@ -127,12 +164,15 @@ def parse_potential_uri(string, uritype=None):
     return None
 
 
-def find_cached_playlist(name):
+def find_cached_playlist(name, cache_dir='.'):
     """Returns the ID of the playlist with this name or something close enough
-    to it, if it's in the playlist cache. Returns None if no such ID found."""
+    to it, if it's in the playlist cache in `cache_dir`. Returns None if no
+    such ID found."""
+    import difflib
+
     playlists = {}  # name: id
     for filename in CATEGORIES.keys():
-        group = CachedPlaylistGroup.from_filename(filename)
+        group = CachedPlaylistGroup.from_filename(os.path.join(cache_dir, filename))
         playlists.update({playlist.name: playlist for playlist in group})
 
     matches = difflib.get_close_matches(name, playlists.keys(), n=1)
@@ -146,12 +186,12 @@ def find_cached_playlist(name):
     return None
 
 
-def parse_playlist_arg(arg, exit_on_error=True):
+def parse_playlist_arg(arg, exit_on_error=True, cache_dir='.'):
     """Tries to interpret the given string specifying a playlist, as either the
-    name of a playlist in the cache, or a Spotify ID, URI or URL. Returns the
-    Spotify ID."""
+    name of a playlist in the cache (in `cache_dir`), or a Spotify ID, URI or
+    URL. Returns the Spotify ID."""
 
-    cached_playlist = find_cached_playlist(arg)
+    cached_playlist = find_cached_playlist(arg, cache_dir)
     if cached_playlist:
         return cached_playlist.id
 
@@ -176,6 +216,29 @@ def parse_playlist_arg(arg, exit_on_error=True):
     return None
 
 
+def with_next(iterable, last=None):
+    """Yields `(item, next_item)` pairs, where `next_item` is `last` for the
+    last item. Consumes only one item ahead, so works on generators."""
+    iterator = iter(iterable)
+    try:
+        item = next(iterator)
+    except StopIteration:
+        return
+    for next_item in iterator:
+        yield item, next_item
+        item = next_item
+    yield item, last
+
+
+BATCH_SIZE = 100  # maximum number of tracks per add/remove request
+
+
+def batches(items, size=BATCH_SIZE):
+    """Yields successive slices of `items` of up to `size` items each."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 def input_with_commands(prompt, quit=True, skip=None):
     """`skip`, if provided, must be a subclass of `Exception`, and is
     raised if the user types "s" or "skip"."""